@@ -4,7 +4,7 @@ Communicates with Gateway Server on Port 3000
 User Interface for Food Delivery System
 """
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
 import requests
 import json
 
@@ -209,13 +209,17 @@ def user_orders():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
+    next_cursor = None
     try:
-        response = requests.get(f'{GATEWAY_URL}/orders?user_id={session["user_id"]}', timeout=15)
-        orders = response.json().get('orders', []) if response.status_code == 200 else []
+        params = {'user_id': session['user_id'], 'after': request.args.get('after')}
+        response = requests.get(f'{GATEWAY_URL}/orders', params=params, timeout=15)
+        result = response.json() if response.status_code == 200 else {}
+        orders = result.get('orders', [])
+        next_cursor = result.get('next_cursor')
     except:
         orders = []
     
-    return render_template('orders.html', orders=orders, user_name=session.get('name'))
+    return render_template('orders.html', orders=orders, next_cursor=next_cursor, user_name=session.get('name'))
 
 @app.route('/order/<order_id>')
 def order_details(order_id):
@@ -271,14 +275,19 @@ def admin_dashboard():
     if 'admin_id' not in session:
         return redirect(url_for('admin_login'))
     
+    next_cursor = None
     try:
-        response = requests.get(f'{GATEWAY_URL}/admin/orders', timeout=15)
-        orders = response.json().get('orders', []) if response.status_code == 200 else []
+        params = {'after': request.args.get('after')}
+        response = requests.get(f'{GATEWAY_URL}/admin/orders', params=params, timeout=15)
+        result = response.json() if response.status_code == 200 else {}
+        orders = result.get('orders', [])
+        next_cursor = result.get('next_cursor')
     except:
         orders = []
     
     return render_template('admin_dashboard.html', 
                          orders=orders, 
+                         next_cursor=next_cursor,
                          admin_name=session.get('admin_name'))
 
 @app.route('/admin/order/<order_id>/status', methods=['POST'])
@@ -289,7 +298,7 @@ def admin_update_order_status(order_id):
     
     try:
         new_status = request.form.get('status')
-        data = {'status': new_status}
+        data = {'status': new_status, 'expected_status': request.form.get('expected_status')}
         
         response = requests.put(f'{GATEWAY_URL}/admin/orders/{order_id}/status', 
                               json=data, timeout=15)
@@ -297,8 +306,11 @@ def admin_update_order_status(order_id):
         if response.status_code == 200:
             return redirect(url_for('admin_dashboard'))
         else:
+            # e.g. 409 when someone else changed the order first
+            flash(response.json().get('error', 'Status update failed'))
             return redirect(url_for('admin_dashboard'))
     except Exception as e:
+        flash(f'Error: {str(e)}')
         return redirect(url_for('admin_dashboard'))
 
 @app.route('/admin/logout')
@@ -374,15 +386,20 @@ def restaurant_dashboard():
     if 'restaurant_id' not in session:
         return redirect(url_for('restaurant_login'))
     
+    next_cursor = None
     try:
-        response = requests.get(f'{GATEWAY_URL}/restaurant/{session["restaurant_id"]}/orders', timeout=15)
-        orders = response.json().get('orders', []) if response.status_code == 200 else []
+        params = {'after': request.args.get('after')}
+        response = requests.get(f'{GATEWAY_URL}/restaurant/{session["restaurant_id"]}/orders', params=params, timeout=15)
+        result = response.json() if response.status_code == 200 else {}
+        orders = result.get('orders', [])
+        next_cursor = result.get('next_cursor')
     except:
         orders = []
     
     return render_template('restaurant_dashboard.html', 
                          restaurant_name=session.get('restaurant_name'),
-                         orders=orders)
+                         orders=orders,
+                         next_cursor=next_cursor)
 
 @app.route('/restaurant/menu', methods=['GET', 'POST'])
 def restaurant_menu_manage():
@@ -444,7 +461,7 @@ def restaurant_update_order_status(order_id):
         new_status = request.form.get('status')
         action = request.form.get('action')  # 'accept' or 'reject'
         
-        data = {'status': new_status, 'action': action}
+        data = {'status': new_status, 'action': action, 'expected_status': request.form.get('expected_status')}
         
         response = requests.put(f'{GATEWAY_URL}/restaurant/orders/{order_id}/status', 
                               json=data, timeout=15)
@@ -452,8 +469,11 @@ def restaurant_update_order_status(order_id):
         if response.status_code == 200:
             return redirect(url_for('restaurant_dashboard'))
         else:
+            # e.g. 409 when someone else changed the order first
+            flash(response.json().get('error', 'Status update failed'))
             return redirect(url_for('restaurant_dashboard'))
     except Exception as e:
+        flash(f'Error: {str(e)}')
         return redirect(url_for('restaurant_dashboard'))
 
 @app.route('/restaurant/logout')
@@ -47,6 +47,18 @@ function getBackendByType(type) {
   return backend;
 }
 
+/**
+ * Proxy a GET to an order listing without buffering it, so ?stream=ndjson|json
+ * responses keep their content type and stay constant-memory through the gateway
+ */
+async function pipeListing(url, req, res) {
+  const response = await axios.get(url, { params: req.query, responseType: 'stream' });
+  res.status(response.status);
+  if (response.headers['content-type']) res.set('Content-Type', response.headers['content-type']);
+  response.data.on('error', () => res.destroy());
+  response.data.pipe(res);
+}
+
 /**
  * Health Check
  */
@@ -223,7 +235,7 @@ app.get('/api/orders', async (req, res) => {
     const userId = req.query.user_id;
     console.log(`📤 GET /api/orders?user_id=${userId} → Python Server (5001)`);
     const backend = getBackendByType('python');
-    const response = await axios.get(`${backend.url}/orders?user_id=${userId}`);
+    const response = await axios.get(`${backend.url}/orders`, { params: req.query });
     res.status(response.status).json(response.data);
   } catch (error) {
     console.error('❌ Get orders error:', error.message);
@@ -270,8 +282,7 @@ app.get('/api/admin/orders', async (req, res) => {
   try {
     console.log('📤 GET /api/admin/orders → Python Server (5001)');
     const backend = getBackendByType('python');
-    const response = await axios.get(`${backend.url}/admin/orders`);
-    res.status(response.status).json(response.data);
+    await pipeListing(`${backend.url}/admin/orders`, req, res);
   } catch (error) {
     console.error('❌ Get all orders error:', error.message);
     res.status(500).json({ error: 'Failed to fetch orders' });
@@ -378,8 +389,7 @@ app.get('/api/restaurant/:id/orders', async (req, res) => {
   try {
     console.log(`📤 GET /api/restaurant/${req.params.id}/orders → Python Server (5001)`);
     const backend = getBackendByType('python');
-    const response = await axios.get(`${backend.url}/restaurant/${req.params.id}/orders`);
-    res.status(response.status).json(response.data);
+    await pipeListing(`${backend.url}/restaurant/${req.params.id}/orders`, req, res);
   } catch (error) {
     console.error('❌ Get restaurant orders error:', error.message);
     res.status(500).json({ error: 'Failed to fetch orders' });
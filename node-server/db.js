@@ -228,6 +228,21 @@ function getMenuByRestaurantId(id) {
   });
 }
 
+function getMenuItemsByIds(restaurantId, itemIds) {
+  if (!itemIds.length) return Promise.resolve([]);
+  return new Promise((resolve, reject) => {
+    const placeholders = itemIds.map(() => '?').join(', ');
+    db.all(
+      `SELECT item_id, item_name, image_url FROM restaurant_menu WHERE restaurant_id = ? AND item_id IN (${placeholders})`,
+      [restaurantId, ...itemIds],
+      (err, rows) => {
+        if (err) return reject(err);
+        resolve(rows || []);
+      }
+    );
+  });
+}
+
 function createRestaurant({ name, cuisine, address, location, rating }) {
   return new Promise((resolve, reject) => {
     const id = uuidv4();
@@ -278,6 +293,7 @@ module.exports = {
   listAvailableLocations,
   getRestaurantById,
   getMenuByRestaurantId,
+  getMenuItemsByIds,
   createRestaurant,
   getRestaurantByEmailAndPassword,
   createRestaurantCredentials,
@@ -21,6 +21,7 @@ const {
   listAvailableLocations,
   getRestaurantById,
   getMenuByRestaurantId,
+  getMenuItemsByIds,
   createRestaurant,
   getRestaurantByEmailAndPassword,
   createRestaurantCredentials,
@@ -453,6 +454,15 @@ app.put('/admin/orders/:order_id/status', (req, res) => {
 
 // ==================== INTER-SERVICE COMMUNICATION ENDPOINTS ====================
 
+/**
+ * Tell the Python server to drop its cached restaurant/menu data.
+ * Best effort: cached entries expire on their own anyway.
+ */
+function invalidatePythonCache(payload) {
+  axios.post(`${PYTHON_SERVER_URL}/interservice/cache/invalidate`, payload, { timeout: 2000 })
+    .catch(error => console.warn(`⚠️ Could not invalidate Python server cache: ${error.message}`));
+}
+
 /**
  * POST /notifications/order-status-update - Receive order status notifications from Python
  */
@@ -494,6 +504,30 @@ app.get('/notifications', (req, res) => {
   }
 });
 
+/**
+ * GET /interservice/order-context/:restaurant_id?item_ids=a,b - Restaurant plus only the
+ * listed menu items, so Python can build an order in one call. 404s with a JSON error
+ * when the restaurant doesn't exist
+ */
+app.get('/interservice/order-context/:restaurant_id', (req, res) => {
+  try {
+    const itemIds = [...new Set(String(req.query.item_ids || '').split(',').filter(Boolean))];
+    Promise.all([getRestaurantById(req.params.restaurant_id), getMenuItemsByIds(req.params.restaurant_id, itemIds)])
+      .then(([restaurant, items]) => {
+        if (!restaurant) return res.status(404).json({ error: 'Restaurant not found' });
+        // Same image fallback as GET /restaurants/:id/menu
+        const enhanced = items.map(item => ({
+          item_id: item.item_id,
+          image_url: item.image_url || `https://source.unsplash.com/400x250/?${encodeURIComponent(item.item_name)}%20food`
+        }));
+        return res.json({ restaurant, items: enhanced });
+      })
+      .catch(error => res.status(500).json({ error: error.message }));
+  } catch (error) {
+    return res.status(500).json({ error: error.message });
+  }
+});
+
 /**
  * POST /interservice/verify-user - Verify user exists (called by Python if needed)
  */
@@ -722,6 +756,7 @@ app.post('/restaurant/menu/add', (req, res) => {
           return res.status(500).json({ error: 'Failed to add menu item' });
         }
         console.log(`✅ Menu item added: ${item_name}`);
+        invalidatePythonCache({ restaurant_id });
         res.status(201).json({
           message: 'Menu item added successfully',
           item_id: itemId
@@ -746,6 +781,7 @@ app.delete('/restaurant/menu/:item_id', (req, res) => {
           return res.status(500).json({ error: 'Failed to delete menu item' });
         }
         console.log(`✅ Menu item deleted: ${req.params.item_id}`);
+        invalidatePythonCache({ item_id: req.params.item_id });
         res.json({ message: 'Menu item deleted successfully' });
       }
     );
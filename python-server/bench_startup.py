@@ -0,0 +1,90 @@
+"""
+Worker startup benchmark for the Python orders server.
+
+    python bench_startup.py [--rounds 5] [--workers 4]
+
+Runs against a scratch database in a temp directory and reports:
+  import      importing server.py in a fresh interpreter (must not create the DB)
+  init cold   create_app() on an empty database (migrations + index checks)
+  init warm   create_app() on an up-to-date database, i.e. a worker boot
+  fork        forked worker (as under gunicorn --preload) serving its first
+              order query, including opening its own connections
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_python(code, env):
+    """Run `code` in a fresh interpreter; it prints a duration in seconds."""
+    out = subprocess.run([sys.executable, '-c', code], cwd=HERE, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def report(name, samples):
+    ms = [1000 * s for s in samples]
+    print(f'{name:<10} median {statistics.median(ms):8.1f} ms   max {max(ms):8.1f} ms   (n={len(ms)})')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='orders-startup-')
+    db_path = os.path.join(tmp, 'orders.db')
+    env = dict(os.environ, ORDERS_DB_PATH=db_path, ORDERS_ARCHIVE_DB_PATH=os.path.join(tmp, 'archive.db'))
+    timed_import = 'import time; t = time.perf_counter(); import server; print(time.perf_counter() - t)'
+    timed_init = ('import time, server; t = time.perf_counter(); server.create_app(); '
+                  'print(time.perf_counter() - t)')
+    try:
+        report('import', [run_python(timed_import, env) for _ in range(args.rounds)])
+        if os.path.exists(db_path):
+            raise SystemExit('❌ importing server.py created the database')
+
+        cold = []
+        for _ in range(args.rounds):
+            for name in os.listdir(tmp):
+                os.remove(os.path.join(tmp, name))
+            cold.append(run_python(timed_init, env))
+        report('init cold', cold)
+        report('init warm', [run_python(timed_init, env) for _ in range(args.rounds)])
+
+        # Preload: build the app once here, then fork workers like gunicorn does
+        os.environ.update(env)
+        sys.path.insert(0, HERE)
+        import server
+        app = server.create_app()
+        samples = []
+        for _ in range(args.workers):
+            read_fd, write_fd = os.pipe()
+            started = time.perf_counter()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                status = app.test_client().get('/admin/orders?limit=1').status_code
+                os.write(write_fd, f'{status} {time.perf_counter() - started}'.encode())
+                os._exit(0)
+            os.close(write_fd)
+            with os.fdopen(read_fd) as fp:
+                status, elapsed = fp.read().split()
+            os.waitpid(pid, 0)
+            if status != '200':
+                raise SystemExit(f'❌ forked worker got HTTP {status}')
+            samples.append(float(elapsed))
+        report('fork', samples)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
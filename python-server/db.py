@@ -1,16 +1,955 @@
 # SQLite database helpers for Python Orders Server
+import glob
 import sqlite3
-import json
-from datetime import datetime
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
+from contextlib import contextmanager
+from itertools import islice
+from datetime import datetime, timedelta
 import os
+import pathlib
 
-DB_PATH = os.path.join(os.path.dirname(__file__), 'food_delivery_py.db')
+from migrations import migrate
+from orders import (
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_BATCH_SIZE,
+    ORDER_ITEM_COLUMNS,
+    TERMINAL_STATUSES,
+    DuplicateOrderError,
+    StatusConflictError,
+    Order,
+    build_orders_query,
+    iter_spooled,
+    merge_orders,
+    order_rows,
+    restaurant_conditions,
+    resolve_fields,
+    select_columns,
+    spool_import,
+    transition_sources,
+    unknown_status_conditions,
+)
+
+DB_PATH = os.environ.get('ORDERS_DB_PATH', os.path.join(os.path.dirname(__file__), 'food_delivery_py.db'))
+# Cold storage for old delivered/rejected/cancelled orders (see archive_orders)
+ARCHIVE_DB_PATH = os.environ.get('ORDERS_ARCHIVE_DB_PATH', os.path.splitext(DB_PATH)[0] + '_archive.db')
+
+# Orders can be split across DB_SHARDS files by a hash of restaurant_id so
+# writes to different shards don't queue on one SQLite write lock. With more
+# than one shard, shard i lives at <db>_shard<i>.db. The shard count is part
+# of the data layout: to change it, export with the old count and import
+# into empty files with the new one. init_db refuses to start while orders
+# sit in files the configured count would not read.
+DB_SHARDS = max(1, int(os.environ.get('DB_SHARDS', 1)))
+
+# Connection pool settings (one connection per concurrent request thread),
+# per shard. Reads go to a read-only pool; writes to a smaller pool since
+# SQLite serializes writers anyway.
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+WRITE_POOL_SIZE = int(os.environ.get('DB_WRITE_POOL_SIZE', 4))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', 30))
+
+# Prepared statements kept per connection (sqlite3 caches them by exact SQL
+# text). Must exceed the number of distinct statements the app runs, which
+# get_metrics() reports as queries.distinct_statements.
+CACHED_STATEMENTS = int(os.environ.get('DB_CACHED_STATEMENTS', 256))
+
+# Optional group commit for order inserts: a background writer commits
+# bursts of inserts together, waiting at most MAX_DELAY for a batch to fill.
+GROUP_COMMIT = os.environ.get('DB_GROUP_COMMIT', '').lower() in ('1', 'true', 'yes')
+GROUP_COMMIT_MAX_DELAY = float(os.environ.get('DB_GROUP_COMMIT_MAX_DELAY_MS', 3)) / 1000
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('DB_GROUP_COMMIT_MAX_BATCH', 64))
+
+# Rows fetched per fetchmany() when streaming or bulk-loading orders
+BULK_CHUNK_SIZE = int(os.environ.get('DB_BULK_CHUNK_SIZE', 1000))
+
+# Nightly maintenance (VACUUM, ANALYZE, checkpoint, integrity check), see
+# run_maintenance. Set a local-time window like '03:00-04:00' to have the
+# server run it automatically; `python -m db maintain` runs it on demand.
+MAINTENANCE_WINDOW = os.environ.get('DB_MAINTENANCE_WINDOW', '')
+# Touched after every completed run; its mtime is shared by all processes
+MAINTENANCE_MARKER_PATH = f'{DB_PATH}.maintenance.last'
+MAINTENANCE_ANALYSIS_LIMIT = int(os.environ.get('DB_ANALYSIS_LIMIT', 1000))  # rows sampled per index
+
+# Storage configuration. WAL lets readers (dashboards) run alongside the
+# writer, and synchronous=NORMAL only fsyncs at checkpoints in WAL mode: a
+# crash can't corrupt the database, but a power failure can lose the last
+# commits even though they were acknowledged.
+JOURNAL_MODE = os.environ.get('DB_JOURNAL_MODE', 'WAL').upper()
+PRAGMAS = {
+    'synchronous': os.environ.get('DB_SYNCHRONOUS', 'NORMAL').upper(),
+    'cache_size': int(os.environ.get('DB_CACHE_SIZE', -16000)),  # negative = KiB
+    'mmap_size': int(os.environ.get('DB_MMAP_SIZE', 64 * 1024 * 1024)),
+    'temp_store': os.environ.get('DB_TEMP_STORE', 'MEMORY').upper(),
+}
+# The group-commit writer fsyncs every batch (synchronous=FULL, or EXTRA if
+# configured) so an order is durable by the time create_order returns
+GROUP_COMMIT_PRAGMAS = {**PRAGMAS, 'synchronous': 'EXTRA' if PRAGMAS['synchronous'] == 'EXTRA' else 'FULL'}
+
+_ALLOWED_PRAGMA_VALUES = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'},
+}
+
+
+def _check_pragma(name, value):
+    allowed = _ALLOWED_PRAGMA_VALUES.get(name)
+    if allowed is not None and value not in allowed:
+        raise ValueError(f'Invalid value for PRAGMA {name}: {value!r}')
+    return value
+
+
+def apply_pragmas(conn, pragmas=None):
+    """Apply per-connection tuning pragmas."""
+    for name, value in (pragmas or PRAGMAS).items():
+        conn.execute(f'PRAGMA {name} = {_check_pragma(name, value)}')
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections with checkout/checkin.
+
+    Connections are created lazily up to `size`. A connection that has been
+    idle longer than `health_check_interval` is pinged before being handed
+    out and replaced if it is no longer usable.
+    """
+
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 health_check_interval=POOL_HEALTH_CHECK_INTERVAL, readonly=False, pragmas=None):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self.pragmas = pragmas
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _connect(self):
+        if self.readonly:
+            conn = sqlite3.connect(f'{pathlib.Path(self.path).resolve().as_uri()}?mode=ro', uri=True,
+                                   timeout=self.timeout, check_same_thread=False,
+                                   cached_statements=CACHED_STATEMENTS)
+            conn.execute('PRAGMA query_only = ON')
+        else:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                                   cached_statements=CACHED_STATEMENTS)
+        conn.execute('PRAGMA foreign_keys = ON')
+        apply_pragmas(conn, self.pragmas)
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        """Check out a connection, waiting up to `timeout` seconds if the pool is exhausted."""
+        try:
+            conn, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    try:
+                        return self._connect()
+                    except Exception:
+                        self._created -= 1
+                        raise
+            try:
+                conn, last_used = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f'No database connection available after {self.timeout}s')
+
+        if time.monotonic() - last_used > self.health_check_interval and not self._is_healthy(conn):
+            self._discard(conn)
+            return self.acquire()
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back any open transaction."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close all idle connections."""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def reset_after_fork(self):
+        """Forget connections inherited from the parent process.
+
+        They are dropped rather than closed: SQLite handles must not be used,
+        or closed, in a process other than the one that opened them.
+        """
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._lock = threading.Lock()
+        self._created = 0
+
+
+class GroupCommitWriter:
+    """Background writer that commits queued statements in small batches.
+
+    `submit` blocks until the statement's batch has committed, and `pool`
+    should run synchronous=FULL (see GROUP_COMMIT_PRAGMAS) so that commit
+    is fsynced: callers get durable, acknowledged writes, but a burst of N
+    inserts costs one fsync instead of N. Each submitted unit of work runs
+    under its own savepoint so one failing insert does not fail the rest of
+    its batch.
+    The thread starts on first use, i.e. after any gunicorn fork.
+    """
+
+    def __init__(self, pool, max_delay=GROUP_COMMIT_MAX_DELAY, max_batch=GROUP_COMMIT_MAX_BATCH):
+        self.pool = pool
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'batches': 0, 'statements': 0, 'max_batch_size': 0,
+                       'total_ack_latency': 0.0, 'max_ack_latency': 0.0}
+
+    def reset_after_fork(self):
+        """The parent's writer thread does not exist in a forked child; start afresh."""
+        self.pool.reset_after_fork()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='order-group-commit', daemon=True)
+                self._thread.start()
+
+    def submit(self, writes):
+        """Queue `writes` and wait until they are committed. Re-raises their error, if any.
+
+        `writes` is a list of (sql, seq_of_params) pairs run with executemany,
+        all or nothing.
+        """
+        self._ensure_started()
+        done = Future()
+        self._queue.put((writes, done, time.monotonic()))
+        return done.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            results = []
+            try:
+                with self.pool.connection() as conn:
+                    conn.execute('BEGIN IMMEDIATE')
+                    for writes, _, _ in batch:
+                        conn.execute('SAVEPOINT stmt')
+                        try:
+                            for sql, seq_of_params in writes:
+                                conn.executemany(sql, seq_of_params)
+                            conn.execute('RELEASE stmt')
+                            results.append(None)
+                        except sqlite3.Error as e:
+                            conn.execute('ROLLBACK TO stmt')
+                            conn.execute('RELEASE stmt')
+                            results.append(e)
+                    conn.commit()
+            except Exception as e:
+                results = [e] * len(batch)
+            now = time.monotonic()
+            self._record(len(batch), [now - submitted for _, _, submitted in batch])
+            for (_, done, _), error in zip(batch, results):
+                if error is None:
+                    done.set_result(None)
+                else:
+                    done.set_exception(error)
+
+    def _record(self, size, latencies):
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['statements'] += size
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], size)
+            self._stats['total_ack_latency'] += sum(latencies)
+            self._stats['max_ack_latency'] = max(self._stats['max_ack_latency'], max(latencies))
+
+    def stats(self):
+        """Batch size and submit-to-commit latency counters."""
+        with self._stats_lock:
+            s = dict(self._stats)
+        return {
+            'batches': s['batches'],
+            'statements': s['statements'],
+            'avg_batch_size': round(s['statements'] / s['batches'], 2) if s['batches'] else 0,
+            'max_batch_size': s['max_batch_size'],
+            'avg_ack_latency_ms': round(1000 * s['total_ack_latency'] / s['statements'], 3) if s['statements'] else 0,
+            'max_ack_latency_ms': round(1000 * s['max_ack_latency'], 3),
+            'queued': self._queue.qsize(),
+        }
+
+
+class QueryRegistry:
+    """Named SQL statements with per-name call counts and timings.
+
+    Call sites run statements by name, so each one always sends the same SQL
+    text and stays a hit in the connection's prepared-statement cache.
+    Dynamic statements (listing queries with optional filters) pass their
+    SQL explicitly but are still timed under a stable name. Rows can be
+    mapped by column name (fetch_dicts) instead of position.
+    """
+
+    def __init__(self, cache_size=CACHED_STATEMENTS):
+        self.cache_size = cache_size
+        self._sql = {}
+        self._seen = set()
+        self._warned = False
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+    def register(self, name, sql):
+        """Add a named statement; returns its SQL."""
+        if self._sql.get(name, sql) != sql:
+            raise ValueError(f'Query {name!r} is already registered with different SQL')
+        self._sql[name] = sql
+        return sql
+
+    def sql(self, name):
+        return self._sql[name]
+
+    @contextmanager
+    def timed(self, name, sql=None):
+        """Time the enclosed block under `name`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - started, sql)
+
+    def _record(self, name, elapsed, sql):
+        with self._lock:
+            s = self._stats.get(name)
+            if s is None:
+                s = self._stats[name] = {'calls': 0, 'total': 0.0, 'max': 0.0}
+            s['calls'] += 1
+            s['total'] += elapsed
+            s['max'] = max(s['max'], elapsed)
+            if sql is not None and sql not in self._seen:
+                self._seen.add(sql)
+                if len(self._seen) > self.cache_size and not self._warned:
+                    self._warned = True
+                    print(f'⚠️ {len(self._seen)} distinct SQL statements exceed DB_CACHED_STATEMENTS={self.cache_size}')
+
+    def execute(self, conn, name, params=(), sql=None):
+        """Execute a statement and return the cursor. Times the first step only."""
+        sql = sql or self._sql[name]
+        with self.timed(name, sql):
+            return conn.execute(sql, params)
+
+    def executemany(self, conn, name, seq_of_params, sql=None):
+        sql = sql or self._sql[name]
+        with self.timed(name, sql):
+            return conn.executemany(sql, seq_of_params)
+
+    def fetchall(self, conn, name, params=(), sql=None):
+        sql = sql or self._sql[name]
+        with self.timed(name, sql):
+            return conn.execute(sql, params).fetchall()
+
+    def fetchone(self, conn, name, params=(), sql=None):
+        sql = sql or self._sql[name]
+        with self.timed(name, sql):
+            return conn.execute(sql, params).fetchone()
+
+    def fetch_dicts(self, conn, name, params=(), sql=None):
+        """All rows as dicts keyed by result column name."""
+        sql = sql or self._sql[name]
+        with self.timed(name, sql):
+            cur = conn.execute(sql, params)
+            rows = cur.fetchall()
+        columns = [d[0] for d in cur.description]
+        return [dict(zip(columns, r)) for r in rows]
+
+    def stats(self):
+        """Per-query call counts and latencies, plus statement cache sizing."""
+        with self._lock:
+            stats = {name: dict(s) for name, s in self._stats.items()}
+            distinct = len(self._seen)
+        return {
+            'cached_statements': self.cache_size,
+            'distinct_statements': distinct,
+            'by_name': {
+                name: {
+                    'calls': s['calls'],
+                    'avg_ms': round(1000 * s['total'] / s['calls'], 3),
+                    'max_ms': round(1000 * s['max'], 3),
+                    'total_ms': round(1000 * s['total'], 3),
+                }
+                for name, s in sorted(stats.items())
+            },
+        }
+
+
+queries = QueryRegistry()
+
+
+# ==================== SCHEMA ====================
+
+# Schema changes live in migrations/ (see migrations/__init__.py)
+
+EXPECTED_INDEXES = {
+    'idx_orders_user_created',
+    'idx_orders_restaurant_created',
+    'idx_orders_status_created',
+    'idx_orders_created',
+    'idx_orders_restaurant_status_created',
+    'idx_order_items_item',
+    'idx_order_items_restaurant',
+}
+
+# Every fixed statement, by name. Always project explicit columns: rows map
+# to fields by position in Order.from_row, so SELECT * would break as soon
+# as a migration adds a column.
+SQL_ORDER_BY_ID = queries.register('order_by_id', f'SELECT {select_columns()} FROM orders WHERE order_id = ?')
+SQL_UPDATE_STATUS = queries.register('update_status', 'UPDATE orders SET status = ?, updated_at = ? WHERE order_id = ?')
+SQL_UPDATE_STATUS_RETURNING = queries.register(
+    'update_status_returning', f'{SQL_UPDATE_STATUS} RETURNING {select_columns()}')
+SQL_STATUS_BY_ID = queries.register('status_by_id', 'SELECT status FROM orders WHERE order_id = ?')
+SQL_INSERT_ORDER = queries.register('insert_order', (
+    'INSERT INTO orders (order_id, user_id, restaurant_id, restaurant_name, items_json, total, status, created_at, updated_at) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+))
+SQL_EXPORT_ORDERS = queries.register(
+    'export_orders', f'SELECT {select_columns()} FROM orders ORDER BY created_at, order_id')
+SQL_INSERT_ORDER_ITEM = queries.register('insert_order_item', (
+    f'INSERT INTO order_items ({ORDER_ITEM_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)'
+))
+SQL_TOP_ITEMS_BY_RESTAURANT = queries.register('top_items', (
+    'SELECT item_id, max(item_name) AS item_name, sum(quantity) AS total_quantity, count(*) AS order_lines '
+    'FROM order_items WHERE restaurant_id = ? GROUP BY item_id ORDER BY total_quantity DESC LIMIT ?'
+))
+SQL_ITEM_SALES_BY_RESTAURANT = queries.register('item_sales', (
+    'SELECT restaurant_id, sum(quantity) AS total_quantity, count(*) AS order_lines '
+    'FROM order_items WHERE item_id = ? GROUP BY restaurant_id ORDER BY total_quantity DESC'
+))
+
+SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Hot queries checked at startup: (name, sql, sample params)
+QUERY_PLAN_CHECKS = [
+    ('get_order', SQL_ORDER_BY_ID, ('',)),
+    ('get_orders_by_user', build_orders_query(['user_id = ?'], paged=True, limited=True), ('', '', '', 1)),
+    ('get_all_orders', build_orders_query(paged=True, limited=True), ('', '', 1)),
+    ('get_orders_by_restaurant', build_orders_query(['restaurant_id = ?'], paged=True, limited=True), ('', '', '', 1)),
+    ('get_orders_by_restaurant(status, window)',
+     build_orders_query(['restaurant_id = ?', 'status = ?', 'created_at >= ?', 'created_at < ?'], limited=True),
+     ('', '', '', '', 1)),
+    ('get_orders_by_restaurant(status, window, page)',
+     build_orders_query(['restaurant_id = ?', 'status = ?', 'created_at >= ?'], paged=True, limited=True),
+     ('', '', '', '', '', 1)),
+    ('get_top_items', SQL_TOP_ITEMS_BY_RESTAURANT, ('', 1)),
+    ('get_item_sales', SQL_ITEM_SALES_BY_RESTAURANT, ('',)),
+]
+
+def explain_query_plan(conn, sql, params=()):
+    """Return the detail lines of EXPLAIN QUERY PLAN for `sql`."""
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def uses_index(plan, grouped=False):
+    """True if no step of the plan is a full table scan or a temp sort.
+
+    For `grouped` (aggregate) queries, sorting the grouped result is allowed.
+    """
+    for detail in plan:
+        if detail.startswith('SCAN') and 'USING' not in detail:
+            return False
+        if 'TEMP B-TREE' in detail and not (grouped and detail == 'USE TEMP B-TREE FOR ORDER BY'):
+            return False
+    return True
+
+
+def check_indexes(pool):
+    """Verify the expected indexes exist, and warn about hot queries that don't use one.
+
+    Raises RuntimeError listing any missing index. A query plan that skips
+    the indexes (the planner's choice can change after ANALYZE or a SQLite
+    upgrade) is only logged; tests/test_query_plans.py asserts the plans.
+    """
+    with pool.connection() as conn:
+        present = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        missing = sorted(EXPECTED_INDEXES - present)
+        for name, sql, params in QUERY_PLAN_CHECKS:
+            plan = explain_query_plan(conn, sql, params)
+            if not uses_index(plan, grouped='GROUP BY' in sql):
+                print(f'⚠️ {name} does not use an index in {pool.path}: {plan}')
+    if missing:
+        raise RuntimeError(f'Orders schema check failed for {pool.path}: missing index {", ".join(missing)}')
+
+
+def report_unknown_statuses(pool):
+    """Warn about orders whose status is outside the lifecycle: every
+    transition would be rejected, so they need a forced admin update."""
+    conditions, params = unknown_status_conditions()
+    with pool.connection() as conn:
+        rows = conn.execute(f'SELECT status, count(*) FROM orders WHERE {conditions[0]} GROUP BY status',
+                            params).fetchall()
+    if rows:
+        counts = ', '.join(f'{status!r}: {n}' for status, n in rows)
+        print(f'⚠️ {pool.path}: orders with statuses outside the lifecycle ({counts}). '
+              'List them with GET /admin/orders/unknown-status and repair with '
+              'PUT /admin/orders/<order_id>/status {"status": ..., "force": true}')
+
+
+def init_schema(pool):
+    """Bring `pool`'s database up to the latest schema version."""
+    with pool.connection() as conn:
+        # Only takes effect on a new, still empty file (so before journal_mode
+        # writes its header); existing files switch on their next full VACUUM
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        # journal_mode is persistent in the database file, so set it once here
+        conn.execute(f"PRAGMA journal_mode = {_check_pragma('journal_mode', JOURNAL_MODE)}")
+        migrate(conn)
+
+
+# ==================== SHARDS ====================
+
+class Shard:
+    """One orders database file with its own pools and group-commit writer."""
+
+    def __init__(self, index, path):
+        self.index = index
+        self.path = path
+        # Pools connect lazily; read-only connections need the file (and
+        # schema) to exist, which init_db guarantees before handing out shards
+        self.write_pool = ConnectionPool(path, size=WRITE_POOL_SIZE)
+        self.read_pool = ConnectionPool(path, readonly=True)
+        # The writer thread needs one connection, with its own fsync-on-commit setting
+        self.group_writer = (GroupCommitWriter(ConnectionPool(path, size=1, pragmas=GROUP_COMMIT_PRAGMAS))
+                             if GROUP_COMMIT else None)
+
+    def reset_after_fork(self):
+        self.write_pool.reset_after_fork()
+        self.read_pool.reset_after_fork()
+        if self.group_writer:
+            self.group_writer.reset_after_fork()
+
+    def __repr__(self):
+        return f'Shard({self.index}, {self.path!r})'
+
+
+def shard_paths(path=DB_PATH, count=DB_SHARDS):
+    """Database file for each shard; a single shard keeps the plain DB_PATH."""
+    if count == 1:
+        return [path]
+    root, ext = os.path.splitext(path)
+    return [f'{root}_shard{i}{ext or ".db"}' for i in range(count)]
+
+
+def _has_orders(path):
+    """True if the database file at `path` exists and holds at least one order."""
+    if not os.path.exists(path):
+        return False
+    conn = sqlite3.connect(f'{pathlib.Path(path).resolve().as_uri()}?mode=ro', uri=True)
+    try:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'orders'").fetchone() is None:
+            return False
+        return conn.execute('SELECT EXISTS (SELECT 1 FROM orders)').fetchone()[0] == 1
+    finally:
+        conn.close()
+
+
+def check_shard_layout(path=DB_PATH, shard_count=DB_SHARDS):
+    """Verify the files on disk were written with `shard_count` shards.
+
+    Changing DB_SHARDS on an existing deployment would otherwise start on
+    empty files and silently hide every existing order. Opens nothing for
+    writing. Raises RuntimeError describing the mismatch.
+    """
+    paths = shard_paths(path, shard_count)
+    root, ext = os.path.splitext(path)
+    ext = ext or '.db'
+    candidates = [p for p in glob.glob(f'{glob.escape(root)}_shard*{ext}')
+                  if p[len(root) + len('_shard'):-len(ext)].isdigit()]
+    ignored = [p for p in sorted(candidates) + [path] if p not in paths and _has_orders(p)]
+    problems = [f'{p} holds orders but DB_SHARDS={shard_count} does not read it' for p in ignored]
+    existing = [p for p in paths if os.path.exists(p)]
+    if shard_count > 1 and existing and len(existing) < len(paths):
+        missing = [p for p in paths if p not in existing]
+        problems.append(f'shard files {", ".join(missing)} are missing')
+    if problems:
+        raise RuntimeError('Orders data layout does not match DB_SHARDS: ' + '; '.join(problems)
+                           + '. Set DB_SHARDS back, or export with the old count and import with the new one.')
+
+
+_shards = []
+_init_lock = threading.Lock()
+_scatter_executor = None
+_scatter_executor_lock = threading.Lock()
+
+
+def init_db(path=DB_PATH, shard_count=DB_SHARDS):
+    """Check the shard layout, open every shard, apply pending migrations and
+    verify indexes. Idempotent.
+
+    Importing this module touches no files; this runs on first use, or
+    explicitly from the app factory so that under gunicorn --preload it runs
+    once in the master. The connections it used are closed again before
+    returning, so forked workers open their own lazily.
+    """
+    global _shards
+    with _init_lock:
+        if not _shards:
+            check_shard_layout(path, shard_count)
+            shards = [Shard(i, p) for i, p in enumerate(shard_paths(path, shard_count))]
+            for shard in shards:
+                init_schema(shard.write_pool)
+                check_indexes(shard.write_pool)
+                report_unknown_statuses(shard.write_pool)
+                shard.write_pool.close()
+            _shards = shards
+    return _shards
+
+
+def get_shards():
+    """The open shards, initializing the database on first call."""
+    return _shards or init_db()
+
+
+def _after_fork_in_child():
+    global _scatter_executor, _scatter_executor_lock, _archive_pool_lock, _init_lock
+    for shard in _shards:
+        shard.reset_after_fork()
+    _init_lock = threading.Lock()
+    _scatter_executor = None
+    _scatter_executor_lock = threading.Lock()
+    if _archive_pool is not None:
+        _archive_pool.reset_after_fork()
+    _archive_pool_lock = threading.Lock()
+    queries.reset_after_fork()
+    maintenance_scheduler.reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def shard_for(restaurant_id):
+    """The shard that owns `restaurant_id`'s orders.
+
+    crc32 rather than hash() so every process agrees on the placement.
+    """
+    shards = get_shards()
+    if len(shards) == 1:
+        return shards[0]
+    return shards[zlib.crc32(str(restaurant_id).encode('utf-8')) % len(shards)]
+
+
+def _scatter(fn):
+    """Call fn(shard) on every shard in parallel; results come back in shard order.
+
+    The first shard runs on the calling thread and the rest on a shared pool
+    with a thread per pooled read connection, so concurrent requests don't
+    queue behind each other for scatter threads. The worker threads start
+    on first use, i.e. after any gunicorn fork.
+    """
+    global _scatter_executor
+    shards = get_shards()
+    if len(shards) == 1:
+        return [fn(shards[0])]
+    if _scatter_executor is None:
+        with _scatter_executor_lock:
+            if _scatter_executor is None:
+                _scatter_executor = ThreadPoolExecutor(max_workers=(len(shards) - 1) * POOL_SIZE,
+                                                       thread_name_prefix='order-shard')
+    futures = [_scatter_executor.submit(fn, shard) for shard in shards[1:]]
+    first = fn(shards[0])
+    return [first] + [future.result() for future in futures]
+
+
+def _locate_order(order_id):
+    """The shard holding `order_id` in its hot table, or None."""
+    shards = get_shards()
+    if len(shards) == 1:
+        return shards[0]
+
+    def probe(shard):
+        with shard.read_pool.connection() as conn:
+            return queries.fetchone(conn, 'status_by_id', (order_id,)) is not None
+
+    return next((shard for shard, found in zip(shards, _scatter(probe)) if found), None)
 
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-conn.execute('PRAGMA foreign_keys = ON')
 
-conn.execute(
-    '''CREATE TABLE IF NOT EXISTS orders (
+def get_metrics():
+    """Storage metrics for the /metrics endpoint."""
+    return {
+        'backend': 'sqlite',
+        'shards': [
+            {'path': shard.path, 'group_commit': shard.group_writer.stats() if shard.group_writer else None}
+            for shard in _shards
+        ],
+        'queries': queries.stats(),
+        'maintenance': maintenance_scheduler.stats(),
+    }
+
+
+def _order_writes(order):
+    """(sql, seq_of_params) pairs that insert `order` and its order_items rows."""
+    order_row, item_rows = order_rows(order)
+    return [(SQL_INSERT_ORDER, [order_row]), (SQL_INSERT_ORDER_ITEM, item_rows)]
+
+
+def create_order(order):
+    """Insert an order and its line items in one transaction on the restaurant's shard."""
+    shard = shard_for(order.get('restaurant_id'))
+    writes = _order_writes(order)
+    with queries.timed('create_order'):
+        if shard.group_writer:
+            shard.group_writer.submit(writes)
+            return
+        with shard.write_pool.connection() as conn:
+            for sql, seq_of_params in writes:
+                conn.executemany(sql, seq_of_params)
+            conn.commit()
+
+
+def _list_orders(name, conditions=(), params=(), limit=None, after=None, fields=None, shard=None,
+                 include_archive=False):
+    """Run an order listing query, optionally paged by keyset `after`.
+
+    Only the columns for `fields` (see resolve_fields) are fetched, so
+    summary listings never read the items blob. Without a `shard` the query
+    runs on every shard in parallel and the newest `limit` of the merged
+    results are kept; `include_archive` also runs it against the archive
+    file. Timed under query `name`. Returns Order records.
+    """
+    fields = resolve_fields(fields)
+    params = list(params)
+    if after:
+        params.extend(after)
+    if limit is not None:
+        params.append(limit)
+    sql = build_orders_query(conditions, paged=bool(after), limited=limit is not None, fields=fields)
+
+    def query(shard):
+        return query_pool(shard.read_pool)
+
+    def query_pool(pool):
+        with pool.connection() as conn:
+            rows = queries.fetchall(conn, name, params, sql=sql)
+        return [Order.from_row(r, fields) for r in rows]
+
+    if shard is not None:
+        return query(shard)
+    streams = _scatter(query)
+    archive_pool = get_archive_pool() if include_archive else None
+    if archive_pool is not None:
+        streams.append(query_pool(archive_pool))
+    return list(islice(merge_orders(streams), limit))
+
+
+def _iter_orders(name, conditions=(), params=(), after=None, fields=None, chunk_size=BULK_CHUNK_SIZE,
+                 shard=None):
+    """Like _list_orders without a limit, but yields Orders from one cursor
+    per shard `chunk_size` rows at a time so memory stays flat for any
+    result size.
+
+    The pooled connections are held until the generator is exhausted or closed.
+    """
+    fields = resolve_fields(fields)
+    params = list(params) + list(after or ())
+    sql = build_orders_query(conditions, paged=bool(after), fields=fields)
+
+    def stream(shard):
+        with shard.read_pool.connection() as conn:
+            cur = queries.execute(conn, name, params, sql=sql)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for r in rows:
+                    yield Order.from_row(r, fields)
+
+    streams = [stream(shard)] if shard is not None else [stream(s) for s in get_shards()]
+    try:
+        yield from merge_orders(streams)
+    finally:
+        for s in streams:
+            s.close()
+
+
+def get_orders_by_user(user_id, limit=None, after=None, fields=None):
+    """One user's order history, archived orders included."""
+    return _list_orders('orders_by_user', ['user_id = ?'], [user_id], limit=limit, after=after, fields=fields,
+                        include_archive=True)
+
+
+def get_order(order_id):
+    """Look up an order in the hot tables, falling back to the archive."""
+    def lookup(shard):
+        with shard.read_pool.connection() as conn:
+            return queries.fetchone(conn, 'order_by_id', (order_id,))
+
+    r = next((r for r in _scatter(lookup) if r is not None), None)
+    if r is None:
+        pool = get_archive_pool()
+        if pool is not None:
+            with pool.connection() as conn:
+                r = queries.fetchone(conn, 'order_by_id', (order_id,))
+    return Order.from_row(r) if r else None
+
+
+def update_order_status(order_id, new_status, expected_status=None, force=False):
+    """Move an order to `new_status` with a single compare-and-set UPDATE.
+
+    The UPDATE only matches if the current status is one the lifecycle allows
+    `new_status` to follow, or exactly `expected_status` when given, so
+    concurrent updates are resolved by SQLite without a read-modify-write.
+    It runs on the shard that holds the order.
+    Returns the updated Order, or None if the order does not exist. Raises
+    InvalidStatusError for unknown statuses and StatusConflictError if the
+    transition is not allowed from the current status. `force` skips the
+    lifecycle rules, to repair orders stuck outside it.
+    """
+    new_status, from_statuses = transition_sources(order_id, new_status, expected_status, force)
+    shard = _locate_order(order_id)
+    if shard is None:
+        return None
+    name = 'update_status_returning' if SUPPORTS_RETURNING else 'update_status'
+    sql = None  # the registered statement, unless restricted to from_statuses
+    params = (new_status, datetime.now().isoformat(), order_id)
+    if from_statuses is not None:
+        sql = f"{SQL_UPDATE_STATUS} AND status IN ({', '.join('?' * len(from_statuses))})"
+        if SUPPORTS_RETURNING:
+            sql += f' RETURNING {select_columns()}'
+        params += tuple(from_statuses)
+
+    with shard.write_pool.connection() as conn, queries.timed('update_order_status'):
+        if SUPPORTS_RETURNING:
+            rows = queries.fetchall(conn, name, params, sql=sql)
+        else:
+            cur = queries.execute(conn, name, params, sql=sql)
+            rows = queries.fetchall(conn, 'order_by_id', (order_id,)) if cur.rowcount else []
+        if rows:
+            conn.commit()
+            return Order.from_row(rows[0])
+        # Nothing matched: only now look up whether it's missing or a conflict
+        current = queries.fetchone(conn, 'status_by_id', (order_id,))
+        conn.rollback()
+    if current is None:
+        return None
+    raise StatusConflictError(order_id, current[0], new_status)
+
+
+def get_all_orders(limit=None, after=None, fields=None):
+    return _list_orders('all_orders', limit=limit, after=after, fields=fields)
+
+
+def get_orders_with_unknown_status(limit=None, after=None, fields=None):
+    """Orders whose status is outside the lifecycle, so no transition can move them."""
+    conditions, params = unknown_status_conditions()
+    return _list_orders('orders_with_unknown_status', conditions, params, limit=limit, after=after, fields=fields)
+
+
+def get_orders_by_restaurant(restaurant_id, status=None, since=None, until=None, limit=None, after=None,
+                             fields=None):
+    """Orders for one restaurant, newest first.
+
+    Optionally filtered by `status` and a created_at window [`since`,
+    `until`) given as ISO timestamps.
+    """
+    conditions, params = restaurant_conditions(restaurant_id, status, since, until, after)
+    return _list_orders('orders_by_restaurant', conditions, params, limit=limit, after=after, fields=fields,
+                        shard=shard_for(restaurant_id))
+
+
+def iter_all_orders(after=None, fields=None):
+    """Streaming variant of get_all_orders."""
+    return _iter_orders('iter_all_orders', after=after, fields=fields)
+
+
+def iter_orders_by_restaurant(restaurant_id, status=None, since=None, until=None, after=None, fields=None):
+    """Streaming variant of get_orders_by_restaurant."""
+    conditions, params = restaurant_conditions(restaurant_id, status, since, until, after)
+    return _iter_orders('iter_orders_by_restaurant', conditions, params, after=after, fields=fields,
+                        shard=shard_for(restaurant_id))
+
+
+def get_top_items(restaurant_id, limit=10):
+    """Best-selling items for a restaurant by total quantity ordered."""
+    with shard_for(restaurant_id).read_pool.connection() as conn:
+        return queries.fetch_dicts(conn, 'top_items', (restaurant_id, limit))
+
+
+def get_item_sales(item_id):
+    """Total quantity ordered of one item, per restaurant.
+
+    Each restaurant lives on exactly one shard, so per-shard rows just concatenate.
+    """
+    def query(shard):
+        with shard.read_pool.connection() as conn:
+            return queries.fetch_dicts(conn, 'item_sales', (item_id,))
+
+    rows = [r for shard_rows in _scatter(query) for r in shard_rows]
+    if len(_shards) > 1:
+        rows.sort(key=lambda r: r['total_quantity'], reverse=True)
+    return rows
+
+
+# ==================== ARCHIVAL ====================
+
+# Run on a write connection with the archive file attached as `archive`
+ARCHIVE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS archive.orders (
         order_id TEXT PRIMARY KEY,
         user_id TEXT,
         restaurant_id TEXT,
@@ -19,77 +958,513 @@ conn.execute(
         total REAL,
         status TEXT,
         created_at TEXT,
-        updated_at TEXT
-    )'''
-)
+        updated_at TEXT,
+        archived_at TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_archive_orders_user_created ON orders (user_id, created_at, order_id)',
+    '''CREATE TABLE IF NOT EXISTS archive.order_items (
+        order_id TEXT NOT NULL,
+        line_no INTEGER NOT NULL,
+        item_id TEXT,
+        item_name TEXT,
+        quantity INTEGER NOT NULL DEFAULT 1,
+        restaurant_id TEXT,
+        created_at TEXT,
+        PRIMARY KEY (order_id, line_no)
+    )''',
+]
 
-# Light migration: add image_url column if it doesn't exist
-try:
-    conn.execute('ALTER TABLE orders ADD COLUMN items_with_images_json TEXT')
-except sqlite3.OperationalError:
-    pass  # Column already exists or table doesn't support it
+_archive_pool = None
+_archive_pool_lock = threading.Lock()
 
-conn.commit()
 
+def get_archive_pool():
+    """Read-only pool on the archive file, or None if nothing was archived yet."""
+    global _archive_pool
+    if _archive_pool is None and os.path.exists(ARCHIVE_DB_PATH):
+        with _archive_pool_lock:
+            if _archive_pool is None:
+                _archive_pool = ConnectionPool(ARCHIVE_DB_PATH, size=2, readonly=True)
+    return _archive_pool
 
-def create_order(order):
-    conn.execute(
-        'INSERT INTO orders (order_id, user_id, restaurant_id, restaurant_name, items_json, total, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
-        (
-            order['order_id'],
-            order['user_id'],
-            order['restaurant_id'],
-            order['restaurant_name'],
-            json.dumps(order.get('items', [])),
-            float(order.get('total', 0)),
-            order.get('status', 'pending'),
-            order['created_at'],
-            order.get('updated_at')
-        )
-    )
-    conn.commit()
 
+def archive_orders(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, dry_run=False):
+    """Move terminal-status orders older than `older_than_days` to the archive DB.
 
-def get_orders_by_user(user_id):
-    cur = conn.execute('SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
-    rows = cur.fetchall()
-    return [
-        {
-            'order_id': r[0], 'user_id': r[1], 'restaurant_id': r[2], 'restaurant_name': r[3],
-            'items': json.loads(r[4] or '[]'), 'total': r[5], 'status': r[6],
-            'created_at': r[7], 'updated_at': r[8]
-        }
-        for r in rows
-    ]
+    Orders move `batch_size` at a time, each batch in its own short write
+    transaction, so live writers only ever wait for one batch. Rows are
+    copied with INSERT OR REPLACE before they are deleted, so a crash between
+    the two (SQLite can't make WAL commits atomic across attached files)
+    leaves at worst a duplicate that the next run cleans up. Shards are
+    archived one after another into the same archive file. Returns the
+    number of orders moved, or that would be moved with `dry_run`.
+    """
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+    terminal = sorted(TERMINAL_STATUSES)
+    where = f"status IN ({', '.join('?' * len(terminal))}) AND created_at < ?"
+    where_params = [*terminal, cutoff]
 
+    if dry_run:
+        def count(shard):
+            with shard.read_pool.connection() as conn:
+                return queries.fetchone(conn, 'count_archivable', where_params,
+                                        sql=f'SELECT count(*) FROM orders WHERE {where}')[0]
+        return sum(_scatter(count))
 
-def get_order(order_id):
-    cur = conn.execute('SELECT * FROM orders WHERE order_id = ?', (order_id,))
-    r = cur.fetchone()
-    if not r:
-        return None
+    moved = sum(_archive_shard(shard, where, where_params, batch_size) for shard in get_shards())
+    if moved:
+        print(f'🗄️ Archived {moved} orders older than {older_than_days} days')
+    return moved
+
+
+def _archive_shard(shard, where, where_params, batch_size):
+    columns = select_columns()
+    moved = 0
+    with shard.write_pool.connection() as conn:
+        conn.execute('ATTACH DATABASE ? AS archive', (ARCHIVE_DB_PATH,))
+        try:
+            # WAL, like the shards, so user history reads don't block on archive batches
+            conn.execute('PRAGMA archive.journal_mode = WAL')
+            for statement in ARCHIVE_SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    ids = [r[0] for r in queries.fetchall(
+                        conn, 'archivable_ids', [*where_params, batch_size],
+                        sql=f'SELECT order_id FROM main.orders WHERE {where} LIMIT ?')]
+                    if not ids:
+                        conn.rollback()
+                        break
+                    in_ids = f"order_id IN ({', '.join('?' * len(ids))})"
+                    with queries.timed('archive_batch'):
+                        conn.execute(
+                            f'INSERT OR REPLACE INTO archive.orders ({columns}, archived_at) '
+                            f'SELECT {columns}, ? FROM main.orders WHERE {in_ids}',
+                            [datetime.now().isoformat(), *ids])
+                        conn.execute(
+                            f'INSERT OR REPLACE INTO archive.order_items ({ORDER_ITEM_COLUMNS}) '
+                            f'SELECT {ORDER_ITEM_COLUMNS} FROM main.order_items WHERE {in_ids}', ids)
+                        conn.execute(f'DELETE FROM main.order_items WHERE {in_ids}', ids)
+                        conn.execute(f'DELETE FROM main.orders WHERE {in_ids}', ids)
+                        conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                moved += len(ids)
+        finally:
+            conn.execute('DETACH DATABASE archive')
+    return moved
+
+
+# ==================== MAINTENANCE ====================
+
+def db_file_stats(conn, path):
+    """Size and free-space figures for the database file behind `conn`.
+
+    `fragmented_ratio` is the share of b-tree pages that don't directly
+    follow their predecessor in key order (None if SQLite lacks dbstat).
+    """
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    wal_path = f'{path}-wal'
+    try:
+        out_of_order = total = 0
+        prev_name = prev_page = None
+        for name, pageno in conn.execute('SELECT name, pageno FROM dbstat ORDER BY name, path'):
+            if name == prev_name and pageno != prev_page + 1:
+                out_of_order += 1
+            total += 1
+            prev_name, prev_page = name, pageno
+        fragmented_ratio = round(out_of_order / total, 4) if total else 0.0
+    except sqlite3.OperationalError:
+        fragmented_ratio = None
     return {
-        'order_id': r[0], 'user_id': r[1], 'restaurant_id': r[2], 'restaurant_name': r[3],
-        'items': json.loads(r[4] or '[]'), 'total': r[5], 'status': r[6],
-        'created_at': r[7], 'updated_at': r[8]
+        'file_bytes': os.path.getsize(path) if os.path.exists(path) else 0,
+        'wal_bytes': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        'page_size': page_size,
+        'page_count': page_count,
+        'free_pages': free_pages,
+        'free_ratio': round(free_pages / page_count, 4) if page_count else 0.0,
+        'fragmented_ratio': fragmented_ratio,
     }
 
 
-def update_order_status(order_id, new_status):
-    ts = datetime.now().isoformat()
-    conn.execute('UPDATE orders SET status = ?, updated_at = ? WHERE order_id = ?', (new_status, ts, order_id))
+def maintain_db_file(conn, path, vacuum='incremental', analyze=True, checkpoint=True, integrity='quick'):
+    """Run the maintenance steps on one database file and return a report.
+
+    vacuum: 'incremental' releases free pages (once auto_vacuum=INCREMENTAL),
+    'full' rewrites the file and switches it to incremental auto-vacuum,
+    None skips. integrity: 'quick', 'full' or None.
+    """
+    started = time.monotonic()
+    report = {'path': path, 'before': db_file_stats(conn, path)}
+
+    if integrity:
+        pragma = 'quick_check' if integrity == 'quick' else 'integrity_check'
+        problems = [row[0] for row in conn.execute(f'PRAGMA {pragma}')]
+        report['integrity'] = 'ok' if problems == ['ok'] else problems
+    if vacuum == 'full':
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')  # takes effect with the VACUUM
+        conn.execute('VACUUM')
+    elif vacuum == 'incremental':
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            # Frees one page per step; executescript steps it to completion
+            conn.executescript('PRAGMA incremental_vacuum')
+        else:
+            report['note'] = 'auto_vacuum is not INCREMENTAL; run once with a full vacuum to enable it'
+    if analyze:
+        conn.execute(f'PRAGMA analysis_limit = {int(MAINTENANCE_ANALYSIS_LIMIT)}')
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA optimize')
+    if checkpoint and conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+        busy, _, _ = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        report['checkpoint'] = 'busy' if busy else 'ok'
     conn.commit()
-    return get_order(order_id)
 
+    report['after'] = db_file_stats(conn, path)
+    report['duration_ms'] = round(1000 * (time.monotonic() - started), 1)
+    return report
 
-def get_all_orders():
-    cur = conn.execute('SELECT * FROM orders ORDER BY created_at DESC')
-    rows = cur.fetchall()
-    return [
-        {
-            'order_id': r[0], 'user_id': r[1], 'restaurant_id': r[2], 'restaurant_name': r[3],
-            'items': json.loads(r[4] or '[]'), 'total': r[5], 'status': r[6],
-            'created_at': r[7], 'updated_at': r[8]
-        }
-        for r in rows
-    ]
+
+@contextmanager
+def _maintenance_lock():
+    """Exclusive, non-blocking file lock so only one process runs maintenance.
+
+    Yields False if another process holds it.
+    """
+    try:
+        import fcntl
+    except ImportError:  # not POSIX: no cross-process lock
+        yield True
+        return
+    with open(f'{DB_PATH}.maintenance.lock', 'w') as fp:
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def last_maintenance_run():
+    """When maintenance last completed in any process, or None if it never has."""
+    try:
+        return datetime.fromtimestamp(os.stat(MAINTENANCE_MARKER_PATH).st_mtime)
+    except OSError:
+        return None
+
+
+def run_maintenance(vacuum='incremental', analyze=True, checkpoint=True, integrity='quick', since=None):
+    """Maintain every shard and the archive file. Returns one report per file, or None if
+    maintenance is already running in another process or, given `since`, has
+    already completed since then."""
+    with _maintenance_lock() as acquired:
+        if not acquired:
+            return None
+        last_run = last_maintenance_run()
+        if since is not None and last_run is not None and last_run >= since:
+            return None
+        reports = []
+        for shard in get_shards():
+            with shard.write_pool.connection() as conn:
+                reports.append(maintain_db_file(conn, shard.path, vacuum, analyze, checkpoint, integrity))
+        if os.path.exists(ARCHIVE_DB_PATH):
+            conn = sqlite3.connect(ARCHIVE_DB_PATH, timeout=POOL_TIMEOUT)
+            try:
+                reports.append(maintain_db_file(conn, ARCHIVE_DB_PATH, vacuum, analyze, checkpoint, integrity))
+            finally:
+                conn.close()
+        with open(MAINTENANCE_MARKER_PATH, 'a'):
+            os.utime(MAINTENANCE_MARKER_PATH)
+    for report in reports:
+        if report.get('integrity', 'ok') != 'ok':
+            print(f"❌ Integrity check failed for {report['path']}: {report['integrity'][:5]}")
+    return reports
+
+
+def format_maintenance_report(report):
+    """One human-readable line for a run_maintenance() report."""
+    def mib(n):
+        return f'{n / (1024 * 1024):.1f} MiB'
+
+    before, after = report['before'], report['after']
+    line = (f"{report['path']}: {mib(before['file_bytes'])} → {mib(after['file_bytes'])}, "
+            f"free pages {before['free_ratio']:.1%} → {after['free_ratio']:.1%}, "
+            f"WAL {mib(before['wal_bytes'])} → {mib(after['wal_bytes'])}")
+    if after['fragmented_ratio'] is not None:
+        line += f", fragmented {before['fragmented_ratio']:.1%} → {after['fragmented_ratio']:.1%}"
+    if 'integrity' in report:
+        line += f", integrity {'ok' if report['integrity'] == 'ok' else 'FAILED'}"
+    line += f" ({report['duration_ms']:.0f} ms)"
+    if 'note' in report:
+        line += f" [{report['note']}]"
+    return line
+
+
+class MaintenanceScheduler:
+    """Runs run_maintenance() once per daily quiet-hours window.
+
+    `window` is 'HH:MM-HH:MM' in local time and may cross midnight. Every
+    worker may start a scheduler; the file lock in run_maintenance makes
+    sure only one of them does the work, and the shared last-run marker
+    makes sure a window already done isn't redone by a worker started (or
+    recycled) later in it. The thread starts on first use, i.e. after any
+    gunicorn fork. A malformed window is reported and leaves the scheduler
+    disabled rather than failing the import.
+    """
+
+    def __init__(self, window=MAINTENANCE_WINDOW):
+        self.window = window
+        self.start = self.end = None
+        if window:
+            try:
+                self.start, self.end = (self._parse(part) for part in window.split('-'))
+            except ValueError:
+                print(f'⚠️ Ignoring DB_MAINTENANCE_WINDOW={window!r}: expected HH:MM-HH:MM '
+                      '(e.g. 03:00-04:30); scheduled maintenance is disabled')
+                self.window = ''
+        self.last_report = None
+        self._last_window = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse(value):
+        return datetime.strptime(value.strip(), '%H:%M').time()
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the scheduler thread in this process, if a window is configured."""
+        if not self.window or (self._pid == os.getpid() and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def next_window(self, now):
+        """(start, end) of the current or next window this scheduler hasn't run in yet."""
+        for day in (now.date() - timedelta(days=1), now.date(), now.date() + timedelta(days=1)):
+            start = datetime.combine(day, self.start)
+            end = datetime.combine(day, self.end)
+            if end <= start:
+                end += timedelta(days=1)
+            if end > now and start != self._last_window:
+                return start, end
+        raise AssertionError('unreachable: tomorrow\'s window is always in the future')
+
+    def _run(self):
+        while True:
+            start, _ = self.next_window(datetime.now())
+            time.sleep(max(0.0, (start - datetime.now()).total_seconds()))
+            self._last_window = start
+            try:
+                reports = run_maintenance(since=start)
+            except Exception as e:
+                print(f'❌ Database maintenance failed: {e}')
+                continue
+            if reports is not None:
+                self.last_report = reports
+                for report in reports:
+                    print(f'🧹 {format_maintenance_report(report)}')
+
+    def stats(self):
+        last_run = last_maintenance_run()
+        return {'window': self.window or None, 'last_run': last_run.isoformat() if last_run else None}
+
+
+maintenance_scheduler = MaintenanceScheduler()
+
+
+# ==================== BULK IMPORT / EXPORT ====================
+
+def iter_orders_ndjson(chunk_size=BULK_CHUNK_SIZE, include_archive=True):
+    """Yield every order as one NDJSON line, oldest first.
+
+    Rows are pulled from one cursor per shard, and one on the archive file
+    unless `include_archive` is false, `chunk_size` at a time and merged on
+    created_at, so memory stays flat however large the tables are.
+    """
+    def stream(pool):
+        with pool.connection() as conn:
+            cur = queries.execute(conn, 'export_orders')
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for r in rows:
+                    yield Order.from_row(r)
+
+    pools = [shard.read_pool for shard in get_shards()]
+    archive_pool = get_archive_pool() if include_archive else None
+    if archive_pool is not None:
+        pools.append(archive_pool)
+    streams = [stream(pool) for pool in pools]
+    try:
+        merged = merge_orders(streams, newest_first=False)
+        while True:
+            chunk = list(islice(merged, chunk_size))
+            if not chunk:
+                break
+            yield ''.join(order.to_json() + '\n' for order in chunk)
+    finally:
+        for s in streams:
+            s.close()
+
+
+def export_orders(fp, chunk_size=BULK_CHUNK_SIZE, include_archive=True):
+    """Write all orders, archived ones too unless `include_archive` is false,
+    to text file `fp` as NDJSON. Returns the order count."""
+    count = 0
+    for chunk in iter_orders_ndjson(chunk_size, include_archive):
+        fp.write(chunk)
+        count += chunk.count('\n')
+    return count
+
+
+def _raise_duplicate(conn, insert_order, batch):
+    """Re-insert a batch that hit a UNIQUE constraint one row at a time and
+    raise DuplicateOrderError for the first order that fails."""
+    for line_no, order in batch:
+        try:
+            conn.execute(insert_order, order_rows(order)[0])
+        except sqlite3.IntegrityError as e:
+            if 'UNIQUE' not in str(e):
+                raise
+            raise DuplicateOrderError(order['order_id'], line_no) from e
+
+
+def import_orders(lines, chunk_size=BULK_CHUNK_SIZE, skip_existing=False):
+    """Insert orders from an iterable of NDJSON lines in one transaction per shard.
+
+    The whole input is read and validated first (see spool_import), so the
+    shard write locks are only taken once it is complete; a slow upload
+    never blocks live writers. Each order goes to its restaurant's shard,
+    written with executemany every `chunk_size` orders. Any bad line
+    (ValueError) or duplicate order_id (DuplicateOrderError) rolls back the
+    whole import, unless `skip_existing` is set, in which case orders that
+    already exist are left untouched. The shard transactions are committed
+    one after another at the end. Returns the number of orders processed.
+    """
+    verb = 'INSERT OR IGNORE' if skip_existing else 'INSERT'
+    insert_order = SQL_INSERT_ORDER.replace('INSERT', verb, 1)
+    insert_item = SQL_INSERT_ORDER_ITEM.replace('INSERT', verb, 1)
+    shards = get_shards()
+    spools, count = spool_import(lines, lambda order: shard_for(order.get('restaurant_id')).index)
+
+    def flush(conn, batch):
+        order_batch, item_batch = [], []
+        for _, order in batch:
+            order_row, items = order_rows(order)
+            order_batch.append(order_row)
+            item_batch.extend(items)
+        conn.execute('SAVEPOINT import_batch')
+        try:
+            queries.executemany(conn, 'import_orders', order_batch, sql=insert_order)
+        except sqlite3.IntegrityError:
+            conn.execute('ROLLBACK TO import_batch')
+            _raise_duplicate(conn, insert_order, batch)
+            raise
+        queries.executemany(conn, 'import_order_items', item_batch, sql=insert_item)
+        conn.execute('RELEASE import_batch')
+
+    with ExitStack() as stack:
+        for fp in spools.values():
+            stack.callback(fp.close)
+        conns = {index: stack.enter_context(shards[index].write_pool.connection()) for index in sorted(spools)}
+        for conn in conns.values():
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            for index, conn in conns.items():
+                batch = []
+                for entry in iter_spooled(spools[index]):
+                    batch.append(entry)
+                    if len(batch) >= chunk_size:
+                        flush(conn, batch)
+                        batch = []
+                if batch:
+                    flush(conn, batch)
+            for conn in conns.values():
+                conn.commit()
+        except Exception:
+            for conn in conns.values():
+                conn.rollback()
+            raise
+    return count
+
+
+def main(argv=None):
+    """CLI: python -m db export [-o FILE] | import [-i FILE] [--skip-existing] | archive [--older-than-days N] [--dry-run]
+    | maintain [--full-vacuum] [--integrity quick|full|none] [--no-analyze] [--no-checkpoint]"""
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(prog='python -m db', description='Bulk import/export of orders as NDJSON')
+    sub = parser.add_subparsers(dest='command', required=True)
+    exp = sub.add_parser('export', help='dump all orders as NDJSON')
+    exp.add_argument('-o', '--output', help='output file (default: stdout)')
+    exp.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    exp.add_argument('--no-archive', action='store_true', help='leave out archived orders')
+    imp = sub.add_parser('import', help='load orders from NDJSON')
+    imp.add_argument('-i', '--input', help='input file (default: stdin)')
+    imp.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    imp.add_argument('--skip-existing', action='store_true', help='ignore orders whose order_id already exists')
+    arc = sub.add_parser('archive', help='move old terminal-status orders to the archive database')
+    arc.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS)
+    arc.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    arc.add_argument('--dry-run', action='store_true', help='only count the orders that would move')
+    mnt = sub.add_parser('maintain', help='vacuum, analyze, checkpoint and integrity-check every database file')
+    mnt.add_argument('--full-vacuum', action='store_true',
+                     help='rewrite the files with VACUUM (enables incremental auto-vacuum on old files)')
+    mnt.add_argument('--integrity', choices=('quick', 'full', 'none'), default='quick')
+    mnt.add_argument('--no-analyze', action='store_true')
+    mnt.add_argument('--no-checkpoint', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'maintain':
+        reports = run_maintenance(vacuum='full' if args.full_vacuum else 'incremental', analyze=not args.no_analyze,
+                                  checkpoint=not args.no_checkpoint,
+                                  integrity=None if args.integrity == 'none' else args.integrity)
+        if reports is None:
+            sys.exit('⏳ Maintenance is already running in another process')
+        for report in reports:
+            print(f'🧹 {format_maintenance_report(report)}', file=sys.stderr)
+        if any(report.get('integrity', 'ok') != 'ok' for report in reports):
+            sys.exit(1)
+        return
+
+    started = time.monotonic()
+    if args.command == 'export':
+        fp = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            count = export_orders(fp, args.chunk_size, include_archive=not args.no_archive)
+        finally:
+            if args.output:
+                fp.close()
+        verb = 'Exported'
+    elif args.command == 'archive':
+        count = archive_orders(args.older_than_days, args.batch_size, args.dry_run)
+        verb = 'Would archive' if args.dry_run else 'Archived'
+    else:
+        fp = open(args.input, encoding='utf-8') if args.input else sys.stdin
+        try:
+            count = import_orders(fp, args.chunk_size, args.skip_existing)
+        finally:
+            if args.input:
+                fp.close()
+        verb = 'Imported'
+    print(f'✅ {verb} {count} orders in {time.monotonic() - started:.2f}s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+DESCRIPTION = 'Indexes for per-user, per-restaurant, per-status and recent-first order lookups'
+
+STATEMENTS = [
+    # The base table predates versioned migrations, hence IF NOT EXISTS
+    '''CREATE TABLE IF NOT EXISTS orders (
+        order_id TEXT PRIMARY KEY,
+        user_id TEXT,
+        restaurant_id TEXT,
+        restaurant_name TEXT,
+        items_json TEXT,
+        total REAL,
+        status TEXT,
+        created_at TEXT,
+        updated_at TEXT
+    )''',
+    # order_id makes each index cover the keyset used for pagination
+    'CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at, order_id)',
+    'CREATE INDEX IF NOT EXISTS idx_orders_restaurant_created ON orders (restaurant_id, created_at, order_id)',
+    'CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at, order_id)',
+    'CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at, order_id)',
+]
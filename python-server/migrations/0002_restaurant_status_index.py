@@ -0,0 +1,5 @@
+DESCRIPTION = 'Index for restaurant dashboards filtered by status'
+
+STATEMENTS = [
+    'CREATE INDEX IF NOT EXISTS idx_orders_restaurant_status_created ON orders (restaurant_id, status, created_at, order_id)',
+]
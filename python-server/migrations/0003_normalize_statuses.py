@@ -0,0 +1,21 @@
+DESCRIPTION = 'Normalize legacy status values to the order lifecycle'
+
+_BATCH = 'rowid >= :lo AND rowid < :hi'
+
+# The first statement lower-cases and turns '-'/' ' into '_', so the aliases
+# below only need one spelling each. Anything still outside the lifecycle
+# afterwards is reported at startup and can be repaired with a forced admin
+# status update.
+BACKFILLS = [
+    ('orders', "UPDATE orders SET status = lower(replace(replace(trim(status), '-', '_'), ' ', '_')) "
+               f"WHERE {_BATCH} AND status IS NOT NULL "
+               "AND status != lower(replace(replace(trim(status), '-', '_'), ' ', '_'))"),
+    ('orders', f"UPDATE orders SET status = 'pending' WHERE {_BATCH} AND (status IS NULL OR status IN ('', 'placed'))"),
+    ('orders', f"UPDATE orders SET status = 'accepted' WHERE {_BATCH} AND status = 'confirmed'"),
+    ('orders', f"UPDATE orders SET status = 'preparing' WHERE {_BATCH} AND status IN ('cooking', 'ready')"),
+    ('orders', f"UPDATE orders SET status = 'out_for_delivery' WHERE {_BATCH} "
+               "AND status IN ('dispatched', 'on_the_way', 'picked_up')"),
+    ('orders', f"UPDATE orders SET status = 'delivered' WHERE {_BATCH} AND status IN ('done', 'completed', 'complete')"),
+    ('orders', f"UPDATE orders SET status = 'rejected' WHERE {_BATCH} AND status = 'declined'"),
+    ('orders', f"UPDATE orders SET status = 'cancelled' WHERE {_BATCH} AND status = 'canceled'"),
+]
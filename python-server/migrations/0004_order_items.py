@@ -0,0 +1,25 @@
+DESCRIPTION = 'Normalized order_items table, backfilled from items_json'
+
+STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS order_items (
+        order_id TEXT NOT NULL REFERENCES orders (order_id) ON DELETE CASCADE,
+        line_no INTEGER NOT NULL,
+        item_id TEXT,
+        item_name TEXT,
+        quantity INTEGER NOT NULL DEFAULT 1,
+        restaurant_id TEXT,
+        created_at TEXT,
+        PRIMARY KEY (order_id, line_no)
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_order_items_item ON order_items (item_id, restaurant_id, quantity)',
+    'CREATE INDEX IF NOT EXISTS idx_order_items_restaurant ON order_items (restaurant_id, item_id, quantity, item_name)',
+]
+
+BACKFILLS = [
+    ('orders', """INSERT OR IGNORE INTO order_items (order_id, line_no, item_id, item_name, quantity, restaurant_id, created_at)
+                  SELECT o.order_id, j.key, json_extract(j.value, '$.item_id'), json_extract(j.value, '$.item_name'),
+                         coalesce(json_extract(j.value, '$.quantity'), 1), o.restaurant_id, o.created_at
+                  FROM orders o, json_each(o.items_json) j
+                  WHERE o.rowid >= :lo AND o.rowid < :hi
+                    AND json_valid(o.items_json) AND json_type(o.items_json) = 'array'"""),
+]
@@ -0,0 +1,7 @@
+DESCRIPTION = 'items_with_images_json column (formerly added ad hoc at startup)'
+
+
+def upgrade(conn):
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(orders)')}
+    if 'items_with_images_json' not in columns:
+        conn.execute('ALTER TABLE orders ADD COLUMN items_with_images_json TEXT')
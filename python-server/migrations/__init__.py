@@ -0,0 +1,166 @@
+# Versioned schema migrations for the orders database.
+#
+# Each NNNN_name.py module in this package is one migration, applied in
+# version order and recorded in the schema_version table. Never edit a
+# migration that has shipped; add a new file instead. A module defines:
+#
+#   DESCRIPTION  one line shown in logs and dry runs
+#   STATEMENTS   DDL run together in one short transaction (optional)
+#   BACKFILLS    (table, sql) pairs run in rowid-range batches (optional);
+#                sql must restrict itself with `rowid >= :lo AND rowid < :hi`
+#                and be idempotent, since an interrupted backfill is rerun
+#   upgrade      upgrade(conn) for changes that need to inspect the schema
+#                first; runs in the STATEMENTS transaction (optional)
+import importlib
+import os
+import pkgutil
+import re
+import time
+from datetime import datetime
+
+MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', 1000))
+# Pause between backfill batches so live writers can take the write lock
+MIGRATION_BATCH_PAUSE = float(os.environ.get('MIGRATION_BATCH_PAUSE_MS', 10)) / 1000
+
+_MODULE_NAME = re.compile(r'^(\d{4})_\w+$')
+
+SCHEMA_VERSION_TABLE = '''CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at TEXT NOT NULL,
+    duration_ms REAL
+)'''
+
+
+class Migration:
+    __slots__ = ('version', 'name', 'description', 'statements', 'backfills', 'upgrade')
+
+    def __init__(self, version, name, module):
+        self.version = version
+        self.name = name
+        self.description = getattr(module, 'DESCRIPTION', name)
+        self.statements = list(getattr(module, 'STATEMENTS', ()))
+        self.backfills = list(getattr(module, 'BACKFILLS', ()))
+        self.upgrade = getattr(module, 'upgrade', None)
+
+    def __repr__(self):
+        return f'Migration({self.version}, {self.name!r})'
+
+
+def load_migrations():
+    """All migrations in this package, ordered by version."""
+    migrations = []
+    for info in pkgutil.iter_modules(__path__):
+        match = _MODULE_NAME.match(info.name)
+        if not match:
+            continue
+        module = importlib.import_module(f'{__name__}.{info.name}')
+        migrations.append(Migration(int(match.group(1)), info.name, module))
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f'Duplicate migration versions in {versions}')
+    return migrations
+
+
+MIGRATIONS = load_migrations()
+
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def applied_versions(conn, readonly=False):
+    """Versions recorded in schema_version, creating the table if needed.
+
+    With `readonly` nothing is written: a database without the table has
+    nothing applied.
+    """
+    if readonly:
+        if not _table_exists(conn, 'schema_version'):
+            return set()
+        return {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+    conn.execute(SCHEMA_VERSION_TABLE)
+    conn.commit()
+    return {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+
+
+def pending_migrations(conn, readonly=False):
+    applied = applied_versions(conn, readonly)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def _rowid_range(conn, table):
+    if not _table_exists(conn, table):
+        return 0, 0  # only possible in a dry run, before the table is created
+    lo, hi = conn.execute(f'SELECT min(rowid), max(rowid) FROM {table}').fetchone()
+    return (lo, hi + 1) if lo is not None else (0, 0)
+
+
+def _run_backfill(conn, table, sql, batch_size, pause):
+    """Run `sql` over `table` one rowid range per transaction. Returns rows changed."""
+    lo, end = _rowid_range(conn, table)
+    changed = 0
+    while lo < end:
+        hi = lo + batch_size
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            changed += conn.execute(sql, {'lo': lo, 'hi': hi}).rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        lo = hi
+        if pause and lo < end:
+            time.sleep(pause)
+    return changed
+
+
+def migrate(conn, dry_run=False, batch_size=MIGRATION_BATCH_SIZE, pause=MIGRATION_BATCH_PAUSE):
+    """Apply pending migrations in order. Returns the migrations applied (or pending, with `dry_run`).
+
+    A dry run only reads, so `conn` may be opened read-only.
+
+    A migration's STATEMENTS and upgrade() run in one transaction, then each
+    backfill runs in batches of `batch_size` rowids with its own short
+    transaction, so writers are never blocked for longer than one batch.
+    The version is recorded only after its backfills finish.
+    """
+    pending = pending_migrations(conn, readonly=dry_run)
+    for m in pending:
+        if dry_run:
+            batches = []
+            for table, _ in m.backfills:
+                lo, end = _rowid_range(conn, table)
+                batches.append(f'{table}: {-(-(end - lo) // batch_size)} batches of {batch_size} rowids')
+            detail = f"{len(m.statements)} statements{', upgrade()' if m.upgrade else ''}"
+            if batches:
+                detail += '; backfill ' + ', '.join(batches)
+            print(f'🔎 Pending schema migration {m.version}: {m.description} ({detail})')
+            continue
+
+        started = time.monotonic()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have applied it while we waited for the lock
+            if conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (m.version,)).fetchone():
+                conn.rollback()
+                continue
+            for statement in m.statements:
+                conn.execute(statement)
+            if m.upgrade:
+                m.upgrade(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        changed = sum(_run_backfill(conn, table, sql, batch_size, pause) for table, sql in m.backfills)
+
+        duration_ms = round(1000 * (time.monotonic() - started), 3)
+        conn.execute('INSERT OR IGNORE INTO schema_version (version, description, applied_at, duration_ms) '
+                     'VALUES (?, ?, ?, ?)', (m.version, m.description, datetime.now().isoformat(), duration_ms))
+        conn.commit()
+        backfilled = f', {changed} rows backfilled' if m.backfills else ''
+        print(f'🛠️ Applied schema migration {m.version}: {m.description} ({duration_ms:.0f} ms{backfilled})')
+    return pending
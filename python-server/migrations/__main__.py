@@ -0,0 +1,48 @@
+"""CLI: python -m migrations [--dry-run] [--batch-size N] [DB_PATH ...]"""
+import argparse
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+from migrations import MIGRATION_BATCH_PAUSE, MIGRATION_BATCH_SIZE, migrate
+
+DEFAULT_DB_PATH = os.environ.get(
+    'ORDERS_DB_PATH', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'food_delivery_py.db'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m migrations', description='Apply pending orders schema migrations')
+    parser.add_argument('paths', nargs='*', default=[DEFAULT_DB_PATH],
+                        help='database files to migrate, e.g. every shard (default: ORDERS_DB_PATH)')
+    parser.add_argument('--dry-run', action='store_true', help='list pending migrations and backfill sizes only')
+    parser.add_argument('--batch-size', type=int, default=MIGRATION_BATCH_SIZE, help='rowids per backfill transaction')
+    parser.add_argument('--pause-ms', type=float, default=MIGRATION_BATCH_PAUSE * 1000,
+                        help='sleep between backfill batches')
+    args = parser.parse_args(argv)
+
+    failed = False
+    for path in args.paths:
+        print(f'📂 {path}')
+        try:
+            if args.dry_run:
+                # Read-only, so a dry run never writes and a mistyped path isn't created
+                conn = sqlite3.connect(f'{Path(path).absolute().as_uri()}?mode=ro', uri=True, timeout=30)
+            else:
+                conn = sqlite3.connect(path, timeout=30)
+        except sqlite3.OperationalError as e:
+            print(f'❌ Could not open {path}: {e}')
+            failed = True
+            continue
+        try:
+            pending = migrate(conn, dry_run=args.dry_run, batch_size=args.batch_size, pause=args.pause_ms / 1000)
+        finally:
+            conn.close()
+        if not pending:
+            print('✅ Schema is up to date')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,549 @@
+"""
+HTTP client for python-server's calls to the Node server.
+
+All calls share one keep-alive requests.Session per process, so orders and
+status updates reuse pooled connections instead of opening a new TCP
+connection per call. The session is created on first use, i.e. after any
+gunicorn fork, since sockets must not be shared between workers.
+
+Restaurant records and menus are cached per process (see TTLCache), so
+steady-state order creation makes no calls at all. Each endpoint sits
+behind a CircuitBreaker, so while the Node server is failing, calls fail
+fast instead of tying up workers for a full timeout.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+NODE_SERVER_URL = os.environ.get('NODE_SERVER_URL', 'http://localhost:5002')  # Direct Node Server communication
+# Keep-alive connections kept per host; size it to the worker's thread count
+NODE_POOL_SIZE = int(os.environ.get('NODE_POOL_SIZE', 10))
+NODE_CONNECT_TIMEOUT = float(os.environ.get('NODE_CONNECT_TIMEOUT', 1))
+NODE_READ_TIMEOUT = float(os.environ.get('NODE_READ_TIMEOUT', 5))
+NODE_RETRIES = int(os.environ.get('NODE_RETRIES', 2))
+NODE_RETRY_BACKOFF = float(os.environ.get('NODE_RETRY_BACKOFF', 0.1))
+# Overall budget for the lookups create_order makes, in seconds
+NODE_ORDER_DEADLINE = float(os.environ.get('NODE_ORDER_DEADLINE', 5))
+# After the batch order-context endpoint 404s (an older Node server), use the
+# legacy restaurant + menu calls for this many seconds before trying it again
+NODE_BATCH_RETRY_AFTER = float(os.environ.get('NODE_BATCH_RETRY_AFTER', 300))
+# Restaurant/menu cache: entries are fresh for NODE_CACHE_TTL seconds, then
+# served stale for up to NODE_CACHE_STALE_TTL more while refreshed in the
+# background. NODE_CACHE_SIZE=0 disables caching.
+NODE_CACHE_SIZE = int(os.environ.get('NODE_CACHE_SIZE', 1000))
+NODE_CACHE_TTL = float(os.environ.get('NODE_CACHE_TTL', 60))
+NODE_CACHE_STALE_TTL = float(os.environ.get('NODE_CACHE_STALE_TTL', 300))
+# Most menu item images cached per restaurant; the oldest are dropped first
+NODE_MENU_CACHE_ITEMS = int(os.environ.get('NODE_MENU_CACHE_ITEMS', 500))
+# Touched on invalidation so every worker process drops its cached menus
+NODE_CACHE_EPOCH_FILE = os.environ.get(
+    'NODE_CACHE_EPOCH_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.node_cache_epoch'))
+# Circuit breakers: an endpoint opens when at least NODE_BREAKER_FAILURE_RATE
+# of its calls in the last NODE_BREAKER_WINDOW seconds failed (given at least
+# NODE_BREAKER_MIN_CALLS calls), then fails fast for NODE_BREAKER_OPEN_SECONDS
+# before letting NODE_BREAKER_PROBES trial calls through
+NODE_BREAKER_WINDOW = float(os.environ.get('NODE_BREAKER_WINDOW', 30))
+NODE_BREAKER_MIN_CALLS = int(os.environ.get('NODE_BREAKER_MIN_CALLS', 5))
+NODE_BREAKER_FAILURE_RATE = float(os.environ.get('NODE_BREAKER_FAILURE_RATE', 0.5))
+NODE_BREAKER_OPEN_SECONDS = float(os.environ.get('NODE_BREAKER_OPEN_SECONDS', 15))
+NODE_BREAKER_PROBES = int(os.environ.get('NODE_BREAKER_PROBES', 1))
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+    def __init__(self, endpoint, retry_in):
+        super().__init__(f'Node Server {endpoint} circuit is open (retry in {retry_in:.0f}s)')
+        self.endpoint = endpoint
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker for one endpoint.
+
+    closed: calls go through and their outcomes are kept for `window`
+    seconds. open: calls are refused with CircuitOpenError until
+    `open_seconds` have passed. half_open: up to `probes` calls go through;
+    one success closes the circuit, one failure opens it again.
+    """
+
+    def __init__(self, name, window=NODE_BREAKER_WINDOW, min_calls=NODE_BREAKER_MIN_CALLS,
+                 failure_rate=NODE_BREAKER_FAILURE_RATE, open_seconds=NODE_BREAKER_OPEN_SECONDS,
+                 probes=NODE_BREAKER_PROBES):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = 'closed'
+        self._outcomes = deque()  # (monotonic time, succeeded)
+        self._failures = 0
+        self._opened_at = None
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+        self.calls = self.failed_calls = self.rejected_calls = self.times_opened = 0
+
+    def _trim(self, now):
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            if not self._outcomes.popleft()[1]:
+                self._failures -= 1
+
+    def is_open(self):
+        """True while calls would be refused outright (open, not yet due a probe)."""
+        with self._lock:
+            return self.state == 'open' and time.monotonic() < self._opened_at + self.open_seconds
+
+    def before_call(self):
+        """Reserve a call, or raise CircuitOpenError."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'open':
+                if now < self._opened_at + self.open_seconds:
+                    self.rejected_calls += 1
+                    raise CircuitOpenError(self.name, self._opened_at + self.open_seconds - now)
+                self.state = 'half_open'
+                self._probes_in_flight = 0
+            if self.state == 'half_open':
+                if self._probes_in_flight >= self.probes:
+                    self.rejected_calls += 1
+                    raise CircuitOpenError(self.name, 0)
+                self._probes_in_flight += 1
+            self.calls += 1
+
+    def after_call(self, succeeded):
+        with self._lock:
+            now = time.monotonic()
+            if not succeeded:
+                self.failed_calls += 1
+            if self.state == 'half_open':
+                self._probes_in_flight -= 1
+                if succeeded:
+                    self.state = 'closed'
+                    self._outcomes.clear()
+                    self._failures = 0
+                    print(f'✅ Node Server {self.name} circuit closed')
+                else:
+                    self._open(now)
+                return
+            if self.state == 'open':
+                return  # a call that started before the circuit opened
+            self._outcomes.append((now, succeeded))
+            if not succeeded:
+                self._failures += 1
+            self._trim(now)
+            calls = len(self._outcomes)
+            if calls >= self.min_calls and self._failures / calls >= self.failure_rate:
+                print(f'⚡ Node Server {self.name} circuit opened: {self._failures}/{calls} calls failed '
+                      f'in the last {self.window:g}s')
+                self._open(now)
+
+    def _open(self, now):
+        self.state = 'open'
+        self._opened_at = now
+        self.times_opened += 1
+
+    def stats(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            calls = len(self._outcomes)
+            return {
+                'state': self.state,
+                'window_calls': calls,
+                'window_failure_rate': round(self._failures / calls, 4) if calls else 0.0,
+                'calls': self.calls,
+                'failed_calls': self.failed_calls,
+                'rejected_calls': self.rejected_calls,
+                'times_opened': self.times_opened,
+            }
+
+
+class NodeClient:
+    """Pooled client for one base URL.
+
+    Every call takes an optional `timeout` (seconds, or a (connect, read)
+    pair) overriding the default. Connection failures are retried for any
+    method, since nothing was sent; read failures and 502/503/504 replies
+    only for GETs, which are safe to repeat.
+
+    Each call names its `endpoint`, which picks its circuit breaker. An
+    exception or a 5xx reply, after retries, counts as a failure.
+
+    The session and worker threads live as long as the worker process, so
+    there is nothing to close; a forked child builds its own on first use.
+    """
+
+    def __init__(self, base_url=NODE_SERVER_URL, pool_size=NODE_POOL_SIZE, retries=NODE_RETRIES,
+                 timeout=(NODE_CONNECT_TIMEOUT, NODE_READ_TIMEOUT)):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.retries = retries
+        self.timeout = timeout
+        self._session = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.breakers = {}
+
+    def _new_session(self):
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            status=self.retries,
+            backoff_factor=NODE_RETRY_BACKOFF,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET', 'HEAD'}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _ensure_process(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._session = self._new_session()
+                    self._executor = None
+                    self._pid = os.getpid()
+
+    @property
+    def session(self):
+        """This process's session, created on first use."""
+        self._ensure_process()
+        return self._session
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on this process's worker threads; returns a Future."""
+        self._ensure_process()
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='node-client')
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def breaker(self, endpoint):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self.breakers.setdefault(endpoint, CircuitBreaker(endpoint))
+        return breaker
+
+    def request(self, method, path, endpoint, timeout=None, **kwargs):
+        breaker = self.breaker(endpoint)
+        breaker.before_call()
+        try:
+            response = self.session.request(method, f'{self.base_url}{path}', timeout=timeout or self.timeout,
+                                            **kwargs)
+        except Exception:
+            breaker.after_call(False)
+            raise
+        breaker.after_call(response.status_code < 500)
+        return response
+
+    def get(self, path, endpoint, timeout=None, **kwargs):
+        return self.request('GET', path, endpoint, timeout=timeout, **kwargs)
+
+    def post(self, path, endpoint, json=None, timeout=None, **kwargs):
+        return self.request('POST', path, endpoint, timeout=timeout, json=json, **kwargs)
+
+    def breaker_stats(self):
+        return {name: breaker.stats() for name, breaker in list(self.breakers.items())}
+
+
+node = NodeClient()
+
+
+MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU cache with a TTL and stale-while-revalidate.
+
+    get() returns MISSING for absent or fully expired keys. A key past its
+    TTL but within `stale_ttl` is still returned, and refresh(stale_value)
+    is run on the node client's threads to replace it; a failed refresh
+    keeps the stale value until it expires. None is never cached.
+
+    With `max_items`, values are dicts and put() merges into a fresh entry,
+    keeping that entry's fetch time so nothing outlives its TTL, and drops
+    the oldest items beyond `max_items`. A stale or expired entry is
+    replaced instead.
+    """
+
+    def __init__(self, name, maxsize=NODE_CACHE_SIZE, ttl=NODE_CACHE_TTL, stale_ttl=NODE_CACHE_STALE_TTL,
+                 max_items=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_items = max_items
+        self._entries = OrderedDict()  # key -> (value, fetched_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = self.stale_hits = self.misses = self.evictions = 0
+
+    def get(self, key, refresh=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            age = time.monotonic() - entry[1] if entry else None
+            if entry is None or age >= self.ttl + self.stale_ttl:
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            if age < self.ttl:
+                self.hits += 1
+                return entry[0]
+            self.stale_hits += 1
+            start_refresh = refresh is not None and key not in self._refreshing
+            if start_refresh:
+                self._refreshing.add(key)
+        if start_refresh:
+            node.submit(self._refresh, key, refresh, entry[0])
+        return entry[0]
+
+    def _refresh(self, key, refresh, stale_value):
+        try:
+            self.put(key, refresh(stale_value))
+        except Exception as e:
+            print(f'⚠️ Could not refresh cached {self.name} {key}: {e}')
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def put(self, key, value):
+        if value is None or self.maxsize <= 0:
+            return
+        with self._lock:
+            fetched_at = time.monotonic()
+            if self.max_items is not None:
+                entry = self._entries.get(key)
+                if entry is not None and fetched_at - entry[1] < self.ttl:
+                    value, fetched_at = {**entry[0], **value}, entry[1]
+                if len(value) > self.max_items:
+                    value = dict(islice(value.items(), len(value) - self.max_items, None))
+            self._entries[key] = (value, fetched_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Drop `key`, or every entry if no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def keys_where(self, predicate):
+        """Keys whose cached value satisfies predicate(value)."""
+        with self._lock:
+            return [key for key, (value, _) in self._entries.items() if predicate(value)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+restaurant_cache = TTLCache('restaurant')
+# restaurant_id -> {item_id: image_url} for the menu items looked up so far
+menu_cache = TTLCache('menu', max_items=NODE_MENU_CACHE_ITEMS)
+_cache_epoch = None
+
+
+def _epoch_mtime():
+    try:
+        return os.stat(NODE_CACHE_EPOCH_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _check_cache_epoch():
+    """Drop both caches if another worker signalled an invalidation since we last looked."""
+    global _cache_epoch
+    epoch = _epoch_mtime()
+    if epoch != _cache_epoch:
+        if _cache_epoch is not None or epoch is not None:
+            restaurant_cache.invalidate()
+            menu_cache.invalidate()
+        _cache_epoch = epoch
+
+
+def invalidate_restaurant(restaurant_id=None, item_id=None):
+    """Invalidation hook for restaurant and menu changes on the Node server.
+
+    Drops the cached restaurant and menu images for `restaurant_id`, the
+    menus containing `item_id`, or everything if neither is given. Other worker
+    processes are told via NODE_CACHE_EPOCH_FILE and drop all their entries
+    on their next lookup.
+    """
+    global _cache_epoch
+    if restaurant_id is None and item_id is None:
+        restaurant_cache.invalidate()
+        menu_cache.invalidate()
+    else:
+        restaurant_ids = {restaurant_id} if restaurant_id is not None else set()
+        if item_id is not None:
+            restaurant_ids.update(menu_cache.keys_where(lambda images: str(item_id) in images))
+        for rid in restaurant_ids:
+            restaurant_cache.invalidate(rid)
+            menu_cache.invalidate(rid)
+    try:
+        with open(NODE_CACHE_EPOCH_FILE, 'a'):
+            os.utime(NODE_CACHE_EPOCH_FILE)
+        _cache_epoch = _epoch_mtime()
+    except OSError as e:
+        print(f'⚠️ Could not signal cache invalidation to other workers: {e}')
+
+
+def cache_stats():
+    return {'restaurant': restaurant_cache.stats(), 'menu': menu_cache.stats()}
+
+
+_batch_unsupported_until = 0.0
+
+
+def fetch_restaurant(restaurant_id, timeout=None):
+    """The restaurant record, or None if the Node server doesn't return one."""
+    response = node.get(f'/restaurants/{restaurant_id}', 'restaurant', timeout=timeout)
+    return response.json() if response.status_code == 200 else None
+
+
+def fetch_menu(restaurant_id, timeout=None):
+    """The restaurant's menu items, or None if the Node server doesn't return them."""
+    response = node.get(f'/restaurants/{restaurant_id}/menu', 'menu', timeout=timeout)
+    return response.json().get('menu', []) if response.status_code == 200 else None
+
+
+def fetch_batch_context(restaurant_id, item_ids, timeout=None):
+    """(restaurant, {item_id: image_url}) for just `item_ids`, in one call.
+
+    Returns (None, {}) if the restaurant doesn't exist. Returns None if the
+    Node server has no batch endpoint, and then uses the legacy calls for
+    the next NODE_BATCH_RETRY_AFTER seconds.
+    """
+    global _batch_unsupported_until
+    response = node.get(f'/interservice/order-context/{restaurant_id}', 'order-context',
+                        params={'item_ids': ','.join(map(str, item_ids))}, timeout=timeout)
+    if response.status_code == 404 and response.headers.get('Content-Type', '').startswith('application/json'):
+        return None, {}  # the endpoint's own "Restaurant not found", not Express's unknown-route 404
+    if response.status_code in (404, 405):
+        _batch_unsupported_until = time.monotonic() + NODE_BATCH_RETRY_AFTER
+        print('⚠️ Node Server has no batch order-context endpoint; using restaurant + menu calls')
+        return None
+    response.raise_for_status()
+    body = response.json()
+    return body.get('restaurant'), _menu_images(body.get('items', []))
+
+
+def _menu_images(menu):
+    """{str(item_id): image_url} for the items actually on the menu; ids it
+    doesn't know are left out, so made-up ids never reach the cache."""
+    return {str(item['item_id']): item.get('image_url') or '' for item in menu
+            if item.get('item_id') not in (None, '')}
+
+
+def _gather(calls, deadline):
+    """Run {endpoint: (fn, *args)} concurrently, waiting at most `deadline` seconds.
+
+    Each fn also gets the deadline as its request timeout. Returns
+    {endpoint: result}, with None for calls that failed or missed the
+    deadline; a late call is left to run out its own timeout in the
+    background. Endpoints whose circuit is open are skipped before reaching
+    the thread pool, so they fail instantly even if every pool thread is
+    stuck on a slow call.
+    """
+    timeout = (min(NODE_CONNECT_TIMEOUT, deadline), deadline)
+    results = {}
+    futures = {}
+    for name, (fn, *args) in calls.items():
+        if node.breaker(name).is_open():
+            print(f'⚡ Skipped Node Server {name} lookup: circuit is open')
+            results[name] = None
+        else:
+            futures[name] = node.submit(fn, *args, timeout=timeout)
+    done, _ = wait(futures.values(), timeout=deadline) if futures else ((), ())
+    for name, future in futures.items():
+        results[name] = None
+        if future not in done:
+            print(f'⚠️ Node Server {name} lookup missed the {deadline:g}s deadline')
+        elif isinstance(future.exception(), CircuitOpenError):
+            print(f'⚡ Skipped Node Server {name} lookup: {future.exception()}')
+        elif future.exception() is not None:
+            print(f'❌ Node Server {name} lookup failed: {future.exception()}')
+        else:
+            results[name] = future.result()
+    return results
+
+
+def _load_order_context(restaurant_id, item_ids, deadline):
+    """(restaurant, images) from the Node server: the batch endpoint when it
+    has one and it answers, else the restaurant and full menu calls,
+    concurrently, within what is left of `deadline`."""
+    started = time.monotonic()
+    if started >= _batch_unsupported_until:
+        context = _gather({'order-context': (fetch_batch_context, restaurant_id, item_ids)}, deadline)['order-context']
+        if context is not None:
+            return context
+        deadline -= time.monotonic() - started
+        if deadline <= 0:
+            return None, None
+    results = _gather({'restaurant': (fetch_restaurant, restaurant_id), 'menu': (fetch_menu, restaurant_id)}, deadline)
+    images = _menu_images(results['menu']) if results['menu'] is not None else None
+    return results['restaurant'], images
+
+
+def _refresh_images(restaurant_id, stale_images):
+    """New images for a stale menu_cache entry. Runs on a node client thread,
+    so it calls the Node server directly rather than through _gather."""
+    item_ids = list(stale_images)
+    if time.monotonic() >= _batch_unsupported_until:
+        context = fetch_batch_context(restaurant_id, item_ids)
+        if context is not None:
+            return context[1]
+    menu = fetch_menu(restaurant_id)
+    return _menu_images(menu) if menu is not None else None
+
+
+def fetch_order_context(restaurant_id, item_ids, deadline=NODE_ORDER_DEADLINE):
+    """(restaurant, {item_id: image_url}) for a new order with `item_ids`.
+
+    Item ids are compared and returned as strings, whatever JSON type the
+    client sent. Served from the cache when possible. Otherwise one lookup fetches the
+    restaurant and whichever items aren't cached yet, all within
+    `deadline` seconds. restaurant is None, and images None or missing
+    some items, if the Node server couldn't provide them in time.
+    """
+    _check_cache_epoch()
+    item_ids = list(dict.fromkeys(str(i) for i in item_ids if i not in (None, '')))
+    restaurant = restaurant_cache.get(restaurant_id, refresh=lambda _: fetch_restaurant(restaurant_id))
+    images = menu_cache.get(restaurant_id, refresh=lambda stale: _refresh_images(restaurant_id, stale))
+    missing = [i for i in item_ids if images is MISSING or i not in images]
+    if restaurant is not MISSING and not missing:
+        return restaurant, images
+
+    fetched_restaurant, fetched_images = _load_order_context(restaurant_id, missing, deadline)
+    if restaurant is MISSING:
+        restaurant = fetched_restaurant
+        restaurant_cache.put(restaurant_id, restaurant)
+    if fetched_images:
+        images = {**(images if images is not MISSING else {}), **fetched_images}
+        menu_cache.put(restaurant_id, fetched_images)
+    return restaurant, images if images is not MISSING else None
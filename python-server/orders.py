@@ -0,0 +1,387 @@
+# Order model shared by every storage backend: the Order record, field
+# projection, keyset cursors and the status lifecycle. Nothing here touches
+# a database connection.
+import base64
+import heapq
+import json
+import os
+import tempfile
+
+# Order listings are newest first with order_id as a tie-breaker, which is
+# also the keyset used for pagination.
+ORDER_LIST_SORT = 'created_at DESC, order_id DESC'
+KEYSET_CONDITION = '(created_at, order_id) < (?, ?)'
+
+# Fields of an order record, and the columns they are read from. Listings
+# can select a subset; 'items' is the only field that needs JSON decoding.
+ORDER_FIELDS = ('order_id', 'user_id', 'restaurant_id', 'restaurant_name', 'items',
+                'total', 'status', 'created_at', 'updated_at')
+SUMMARY_FIELDS = tuple(f for f in ORDER_FIELDS if f != 'items')
+FIELD_COLUMNS = {'items': 'items_json'}
+# Always selected: needed for the sort order and pagination cursor
+KEY_FIELDS = ('order_id', 'created_at')
+
+
+# Columns of order_items (and its archive copy), in insert order
+ORDER_ITEM_COLUMNS = 'order_id, line_no, item_id, item_name, quantity, restaurant_id, created_at'
+
+# Archival policy shared by the backends: terminal orders older than this
+# move to cold storage, this many per transaction
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+
+
+def select_columns(fields=ORDER_FIELDS):
+    return ', '.join(FIELD_COLUMNS.get(f, f) for f in fields)
+
+
+# ==================== ORDER LIFECYCLE ====================
+
+# pending -> accepted/preparing -> out_for_delivery -> delivered,
+# with rejected/cancelled as the other terminal states.
+ORDER_STATUSES = ('pending', 'accepted', 'preparing', 'out_for_delivery', 'delivered', 'rejected', 'cancelled')
+STATUS_TRANSITIONS = {
+    'pending': {'accepted', 'preparing', 'rejected', 'cancelled'},
+    'accepted': {'preparing', 'out_for_delivery', 'cancelled'},
+    'preparing': {'out_for_delivery', 'cancelled'},
+    'out_for_delivery': {'delivered'},
+    'delivered': set(),
+    'rejected': set(),
+    'cancelled': set(),
+}
+TERMINAL_STATUSES = {s for s, nxt in STATUS_TRANSITIONS.items() if not nxt}
+
+# Older clients' spellings (migration 0003 rewrites stored ones)
+STATUS_ALIASES = {
+    'placed': 'pending',
+    'confirmed': 'accepted',
+    'cooking': 'preparing',
+    'ready': 'preparing',
+    'dispatched': 'out_for_delivery',
+    'on_the_way': 'out_for_delivery',
+    'picked_up': 'out_for_delivery',
+    'done': 'delivered',
+    'completed': 'delivered',
+    'complete': 'delivered',
+    'declined': 'rejected',
+    'canceled': 'cancelled',
+}
+
+
+class InvalidStatusError(ValueError):
+    """Status is not part of the order lifecycle."""
+
+
+class StatusConflictError(Exception):
+    """The order's current status does not allow the requested transition."""
+
+    def __init__(self, order_id, current_status, new_status):
+        super().__init__(f'Order {order_id} cannot move from {current_status} to {new_status}')
+        self.order_id = order_id
+        self.current_status = current_status
+        self.new_status = new_status
+
+
+class DuplicateOrderError(Exception):
+    """An imported order_id is already stored, or repeats an earlier line."""
+
+    def __init__(self, order_id, line_no):
+        super().__init__(f'Line {line_no}: order {order_id} already exists')
+        self.order_id = order_id
+        self.line_no = line_no
+
+
+def normalize_status(status):
+    """Canonical lifecycle status for `status` (any case, '-' or ' ' separators, aliases)."""
+    key = str(status or '').strip().lower().replace('-', '_').replace(' ', '_')
+    key = STATUS_ALIASES.get(key, key)
+    if key not in STATUS_TRANSITIONS:
+        raise InvalidStatusError(f'Unknown order status: {status!r}')
+    return key
+
+
+def allowed_predecessors(status):
+    """Statuses from which `status` can be reached in one step."""
+    return sorted(s for s, nxt in STATUS_TRANSITIONS.items() if status in nxt)
+
+
+def transition_sources(order_id, new_status, expected_status=None, force=False):
+    """(new_status, from_statuses) for a compare-and-set status update.
+
+    Both statuses are normalized. The UPDATE should only match an order
+    whose current status is in from_statuses: exactly `expected_status` when
+    given, else every allowed predecessor of `new_status`. Raises
+    InvalidStatusError, or StatusConflictError if `expected_status` can't
+    move to `new_status`.
+
+    `force` is the admin repair path for orders stuck outside the lifecycle:
+    the transition rules are skipped, `expected_status` (if any) is matched
+    verbatim, and from_statuses is None when any current status may match.
+    """
+    new_status = normalize_status(new_status)
+    if force:
+        return new_status, [expected_status] if expected_status else None
+    if not expected_status:
+        return new_status, allowed_predecessors(new_status)
+    expected_status = normalize_status(expected_status)
+    if new_status not in STATUS_TRANSITIONS[expected_status]:
+        raise StatusConflictError(order_id, expected_status, new_status)
+    return new_status, [expected_status]
+
+
+class Order:
+    """One row of the orders table.
+
+    Built by `from_row` for every query so row mapping lives in one place.
+    Only the selected `fields` are set. The items blob is kept as raw JSON
+    text and decoded on first access to `items`; `to_json` splices it into
+    the output without decoding at all. Supports `order['status']` and
+    `order.get(...)` so it can stand in for the old dict records.
+    """
+
+    __slots__ = ('fields', 'order_id', 'user_id', 'restaurant_id', 'restaurant_name', 'total',
+                 'status', 'created_at', 'updated_at', '_items', '_items_json')
+
+    @classmethod
+    def from_row(cls, row, fields=ORDER_FIELDS):
+        order = cls.__new__(cls)
+        order.fields = fields
+        order._items = None
+        order._items_json = None
+        for name, value in zip(fields, row):
+            if name == 'items':
+                order._items_json = value
+            else:
+                setattr(order, name, value)
+        return order
+
+    @property
+    def items(self):
+        if self._items is None:
+            self._items = json.loads(self._items_json or '[]')
+        return self._items
+
+    def __getitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.fields else default
+
+    def to_dict(self):
+        return {f: getattr(self, f) for f in self.fields}
+
+    def to_json(self):
+        parts = []
+        for f in self.fields:
+            if f == 'items' and self._items is None:
+                value = self._items_json or '[]'
+            else:
+                value = json.dumps(getattr(self, f))
+            parts.append(f'"{f}": {value}')
+        return '{' + ', '.join(parts) + '}'
+
+    def __repr__(self):
+        return f'Order({self.to_dict()!r})'
+
+
+def resolve_fields(fields=None):
+    """Normalize a field selection to a tuple in ORDER_FIELDS order.
+
+    `fields` may be None (all fields), 'summary' (everything but items), or
+    an iterable / comma-separated string of field names. Raises ValueError
+    for unknown fields.
+    """
+    if fields is None:
+        return ORDER_FIELDS
+    if fields == 'summary':
+        return SUMMARY_FIELDS
+    if isinstance(fields, str):
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = set(fields) - set(ORDER_FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown order fields: {", ".join(sorted(unknown))}')
+    wanted = set(fields) | set(KEY_FIELDS)
+    return tuple(f for f in ORDER_FIELDS if f in wanted)
+
+
+def build_orders_query(conditions=(), paged=False, limited=False, fields=ORDER_FIELDS, table='orders'):
+    """SELECT for an order listing from `table` with the given WHERE conditions."""
+    conditions = list(conditions)
+    if paged:
+        conditions.append(KEYSET_CONDITION)
+    sql = f'SELECT {select_columns(fields)} FROM {table}'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += f' ORDER BY {ORDER_LIST_SORT}'
+    if limited:
+        sql += ' LIMIT ?'
+    return sql
+
+
+def _order_key(order):
+    return order['created_at'] or '', order['order_id']
+
+
+def merge_orders(streams, newest_first=True):
+    """Merge Order streams, each already sorted by (created_at, order_id).
+
+    An order_id seen in more than one stream (an order caught mid-archive in
+    both the hot and the archive table) is yielded once.
+    """
+    if len(streams) == 1:
+        yield from streams[0]
+        return
+    last = None
+    for order in heapq.merge(*streams, key=_order_key, reverse=newest_first):
+        if order['order_id'] != last:
+            last = order['order_id']
+            yield order
+
+
+def restaurant_conditions(restaurant_id, status=None, since=None, until=None, after=None):
+    """WHERE conditions and params for one restaurant's order listing."""
+    conditions = ['restaurant_id = ?']
+    params = [restaurant_id]
+    if status:
+        conditions.append('status = ?')
+        params.append(normalize_status(status))
+    if since:
+        conditions.append('created_at >= ?')
+        params.append(since)
+    # Once the keyset cursor is below `until` it is the tighter upper bound,
+    # and keeping both confuses the planner's index choice
+    if until and not (after and after[0] < until):
+        conditions.append('created_at < ?')
+        params.append(until)
+    return conditions, params
+
+
+def unknown_status_conditions():
+    """WHERE conditions and params for orders whose status is outside the lifecycle."""
+    placeholders = ', '.join('?' * len(ORDER_STATUSES))
+    return [f'(status IS NULL OR status NOT IN ({placeholders}))'], list(ORDER_STATUSES)
+
+
+def encode_cursor(order):
+    """Opaque pagination cursor pointing just past `order`."""
+    raw = json.dumps([order['created_at'], order['order_id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor. Returns None for an empty cursor.
+
+    Raises ValueError if the cursor is malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, order_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+    return created_at, order_id
+
+
+def parse_quantity(value):
+    """An item quantity as a positive int (1 when omitted). Raises ValueError."""
+    if value is None or value == '':
+        return 1
+    try:
+        quantity = int(str(value).strip())
+    except ValueError:
+        quantity = 0
+    if quantity < 1:
+        raise ValueError(f'Invalid quantity: {value!r}')
+    return quantity
+
+
+def order_rows(order):
+    """Row tuples for the orders table and the order_items table."""
+    items = order.get('items', [])
+    order_row = (
+        order['order_id'],
+        order['user_id'],
+        order['restaurant_id'],
+        order['restaurant_name'],
+        json.dumps(items),
+        float(order.get('total', 0)),
+        order.get('status', 'pending'),
+        order['created_at'],
+        order.get('updated_at')
+    )
+    item_rows = [
+        (order['order_id'], line_no, item.get('item_id'), item.get('item_name'),
+         parse_quantity(item.get('quantity')), order['restaurant_id'], order['created_at'])
+        for line_no, item in enumerate(items)
+    ]
+    return order_row, item_rows
+
+
+IMPORT_REQUIRED_FIELDS = ('order_id', 'user_id', 'restaurant_id', 'created_at')
+
+
+def parse_import_line(line, line_no):
+    """Validate one NDJSON import line into an order dict. Raises ValueError."""
+    try:
+        order = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f'Line {line_no}: invalid JSON ({e})') from e
+    if not isinstance(order, dict):
+        raise ValueError(f'Line {line_no}: expected a JSON object')
+    missing = [f for f in IMPORT_REQUIRED_FIELDS if not order.get(f)]
+    if missing:
+        raise ValueError(f'Line {line_no}: missing {", ".join(missing)}')
+    order.setdefault('restaurant_name', 'Unknown')
+    order['total'] = order.get('total') or 0
+    for item in order.get('items') or []:
+        if not isinstance(item, dict):
+            raise ValueError(f'Line {line_no}: expected items to be JSON objects')
+        try:
+            parse_quantity(item.get('quantity'))
+        except ValueError as e:
+            raise ValueError(f'Line {line_no}: {e}') from e
+    try:
+        order['status'] = normalize_status(order.get('status') or 'pending')
+    except InvalidStatusError as e:
+        raise ValueError(f'Line {line_no}: {e}') from e
+    return order
+
+
+def spool_import(lines, partition=lambda order: 0):
+    """Read and validate every NDJSON import line before anything is written.
+
+    Each order goes, with its line number, to a temporary file for
+    partition(order), so a slow upload holds no database locks and memory
+    stays flat. Raises ValueError for the first bad line. Returns
+    ({partition: file}, count); read the files back with iter_spooled.
+    """
+    spools = {}
+    count = 0
+    try:
+        for line_no, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            order = parse_import_line(line, line_no)
+            key = partition(order)
+            if key not in spools:
+                spools[key] = tempfile.TemporaryFile('w+', encoding='utf-8')
+            spools[key].write(json.dumps([line_no, order]) + '\n')
+            count += 1
+    except BaseException:
+        for fp in spools.values():
+            fp.close()
+        raise
+    for fp in spools.values():
+        fp.seek(0)
+    return spools, count
+
+
+def iter_spooled(fp):
+    """(line_no, order) pairs from a spool_import file."""
+    for line in fp:
+        yield json.loads(line)
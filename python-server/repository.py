@@ -0,0 +1,537 @@
+# Storage backends for orders. server.py only talks to an OrderRepository;
+# ORDERS_BACKEND picks the implementation (sqlite by default, or postgres).
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import islice
+
+from orders import (
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_BATCH_SIZE,
+    ORDER_ITEM_COLUMNS,
+    TERMINAL_STATUSES,
+    DuplicateOrderError,
+    Order,
+    StatusConflictError,
+    build_orders_query,
+    iter_spooled,
+    merge_orders,
+    order_rows,
+    resolve_fields,
+    restaurant_conditions,
+    select_columns,
+    spool_import,
+    transition_sources,
+    unknown_status_conditions,
+)
+
+ORDERS_BACKEND = os.environ.get('ORDERS_BACKEND', 'sqlite').lower()
+ORDERS_DATABASE_URL = os.environ.get('ORDERS_DATABASE_URL') or os.environ.get('DATABASE_URL')
+PG_POOL_MIN = int(os.environ.get('PG_POOL_MIN', 1))
+PG_POOL_MAX = int(os.environ.get('PG_POOL_MAX', 10))
+# Seconds a request waits for a free connection once PG_POOL_MAX are in use
+PG_POOL_TIMEOUT = float(os.environ.get('PG_POOL_TIMEOUT', 10))
+
+
+class OrderRepository(ABC):
+    """Everything the API needs from order storage.
+
+    Listing methods return Order records newest first and accept `limit`,
+    an `after` keyset (created_at, order_id) and a `fields` projection.
+    """
+
+    @abstractmethod
+    def create_order(self, order):
+        """Insert an order dict and its line items atomically."""
+
+    @abstractmethod
+    def get_order(self, order_id):
+        """Order by id (including archived orders), or None."""
+
+    @abstractmethod
+    def get_orders_by_user(self, user_id, limit=None, after=None, fields=None):
+        """One user's orders, archived orders included."""
+
+    @abstractmethod
+    def get_all_orders(self, limit=None, after=None, fields=None):
+        """All hot (non-archived) orders."""
+
+    @abstractmethod
+    def get_orders_by_restaurant(self, restaurant_id, status=None, since=None, until=None, limit=None,
+                                 after=None, fields=None):
+        """One restaurant's orders, optionally by status and created_at window."""
+
+    @abstractmethod
+    def iter_all_orders(self, after=None, fields=None):
+        """Streaming variant of get_all_orders."""
+
+    @abstractmethod
+    def iter_orders_by_restaurant(self, restaurant_id, status=None, since=None, until=None, after=None,
+                                  fields=None):
+        """Streaming variant of get_orders_by_restaurant."""
+
+    @abstractmethod
+    def get_orders_with_unknown_status(self, limit=None, after=None, fields=None):
+        """Orders whose stored status is outside the lifecycle, newest first."""
+
+    @abstractmethod
+    def update_order_status(self, order_id, new_status, expected_status=None, force=False):
+        """Compare-and-set status transition. Returns the Order or None if missing.
+
+        `force` skips the lifecycle rules (see orders.transition_sources).
+        Raises InvalidStatusError / StatusConflictError.
+        """
+
+    @abstractmethod
+    def get_top_items(self, restaurant_id, limit=10):
+        """Best-selling items for a restaurant."""
+
+    @abstractmethod
+    def get_item_sales(self, item_id):
+        """Quantity ordered of an item per restaurant."""
+
+    @abstractmethod
+    def iter_orders_ndjson(self, include_archive=True):
+        """All orders, archived ones too unless `include_archive` is false, as
+        NDJSON text chunks, oldest first."""
+
+    @abstractmethod
+    def import_orders(self, lines, skip_existing=False):
+        """Bulk-load NDJSON lines in one transaction, once all are read and
+        validated. Returns the order count. Raises ValueError for a bad line
+        and DuplicateOrderError for an order_id that already exists."""
+
+    @abstractmethod
+    def archive_orders(self, older_than_days=None, dry_run=False):
+        """Move old terminal-status orders to cold storage. Returns the count."""
+
+    @abstractmethod
+    def get_metrics(self):
+        """Backend counters for /metrics."""
+
+    def start_background_jobs(self):
+        """Start this process's housekeeping threads, if any. Called on every request; must be cheap."""
+
+
+class SQLiteOrderRepository(OrderRepository):
+    """The single-file SQLite store in db.py."""
+
+    def __init__(self):
+        import db
+        self.db = db
+        db.init_db()
+
+    def create_order(self, order):
+        return self.db.create_order(order)
+
+    def get_order(self, order_id):
+        return self.db.get_order(order_id)
+
+    def get_orders_by_user(self, user_id, limit=None, after=None, fields=None):
+        return self.db.get_orders_by_user(user_id, limit=limit, after=after, fields=fields)
+
+    def get_all_orders(self, limit=None, after=None, fields=None):
+        return self.db.get_all_orders(limit=limit, after=after, fields=fields)
+
+    def get_orders_by_restaurant(self, restaurant_id, status=None, since=None, until=None, limit=None,
+                                 after=None, fields=None):
+        return self.db.get_orders_by_restaurant(restaurant_id, status=status, since=since, until=until,
+                                                limit=limit, after=after, fields=fields)
+
+    def iter_all_orders(self, after=None, fields=None):
+        return self.db.iter_all_orders(after=after, fields=fields)
+
+    def iter_orders_by_restaurant(self, restaurant_id, status=None, since=None, until=None, after=None,
+                                  fields=None):
+        return self.db.iter_orders_by_restaurant(restaurant_id, status=status, since=since, until=until,
+                                                 after=after, fields=fields)
+
+    def get_orders_with_unknown_status(self, limit=None, after=None, fields=None):
+        return self.db.get_orders_with_unknown_status(limit=limit, after=after, fields=fields)
+
+    def update_order_status(self, order_id, new_status, expected_status=None, force=False):
+        return self.db.update_order_status(order_id, new_status, expected_status, force=force)
+
+    def get_top_items(self, restaurant_id, limit=10):
+        return self.db.get_top_items(restaurant_id, limit)
+
+    def get_item_sales(self, item_id):
+        return self.db.get_item_sales(item_id)
+
+    def iter_orders_ndjson(self, include_archive=True):
+        return self.db.iter_orders_ndjson(include_archive=include_archive)
+
+    def import_orders(self, lines, skip_existing=False):
+        return self.db.import_orders(lines, skip_existing=skip_existing)
+
+    def archive_orders(self, older_than_days=None, dry_run=False):
+        if older_than_days is None:
+            older_than_days = ARCHIVE_AFTER_DAYS
+        return self.db.archive_orders(older_than_days, dry_run=dry_run)
+
+    def get_metrics(self):
+        return self.db.get_metrics()
+
+    def start_background_jobs(self):
+        self.db.maintenance_scheduler.ensure_started()
+
+
+def _pg(sql):
+    """Translate the shared '?' placeholder style to psycopg2's '%s'."""
+    return sql.replace('?', '%s')
+
+
+class PostgresOrderRepository(OrderRepository):
+    """Client/server backend for PostgreSQL (or a wire-compatible database).
+
+    Uses a thread-safe psycopg2 connection pool sized by PG_POOL_MIN /
+    PG_POOL_MAX; when every connection is checked out, callers wait up to
+    PG_POOL_TIMEOUT seconds for one, like the SQLite pool. Archived orders
+    live in orders_archive in the same database.
+    """
+
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS orders (
+            order_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            restaurant_id TEXT,
+            restaurant_name TEXT,
+            items_json TEXT,
+            total DOUBLE PRECISION,
+            status TEXT,
+            created_at TEXT,
+            updated_at TEXT
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at, order_id)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_restaurant_created ON orders (restaurant_id, created_at, order_id)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at, order_id)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at, order_id)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_restaurant_status_created ON orders (restaurant_id, status, created_at, order_id)',
+        '''CREATE TABLE IF NOT EXISTS order_items (
+            order_id TEXT NOT NULL REFERENCES orders (order_id) ON DELETE CASCADE,
+            line_no INTEGER NOT NULL,
+            item_id TEXT,
+            item_name TEXT,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            restaurant_id TEXT,
+            created_at TEXT,
+            PRIMARY KEY (order_id, line_no)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_item ON order_items (item_id, restaurant_id, quantity)',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_restaurant ON order_items (restaurant_id, item_id, quantity, item_name)',
+        '''CREATE TABLE IF NOT EXISTS orders_archive (
+            order_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            restaurant_id TEXT,
+            restaurant_name TEXT,
+            items_json TEXT,
+            total DOUBLE PRECISION,
+            status TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            archived_at TEXT
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_orders_archive_user_created ON orders_archive (user_id, created_at, order_id)',
+        '''CREATE TABLE IF NOT EXISTS order_items_archive (
+            order_id TEXT NOT NULL,
+            line_no INTEGER NOT NULL,
+            item_id TEXT,
+            item_name TEXT,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            restaurant_id TEXT,
+            created_at TEXT,
+            PRIMARY KEY (order_id, line_no)
+        )''',
+    ]
+
+    INSERT_ORDER = (
+        'INSERT INTO orders (order_id, user_id, restaurant_id, restaurant_name, items_json, total, status, '
+        'created_at, updated_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)'
+    )
+    INSERT_ORDER_ITEM = f'INSERT INTO order_items ({ORDER_ITEM_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s)'
+    CHUNK_SIZE = 1000
+
+    def __init__(self, dsn=ORDERS_DATABASE_URL, minconn=PG_POOL_MIN, maxconn=PG_POOL_MAX, timeout=PG_POOL_TIMEOUT):
+        try:
+            import psycopg2
+            import psycopg2.extras
+            import psycopg2.errors
+            import psycopg2.pool
+        except ImportError as e:
+            raise RuntimeError('ORDERS_BACKEND=postgres requires the psycopg2 (or psycopg2-binary) package') from e
+        if not dsn:
+            raise RuntimeError('ORDERS_BACKEND=postgres requires ORDERS_DATABASE_URL or DATABASE_URL')
+        self._extras = psycopg2.extras
+        self._unique_violation = psycopg2.errors.UniqueViolation
+        self._pool_class = psycopg2.pool.ThreadedConnectionPool
+        self._dsn = dsn
+        self._minconn = minconn
+        self._maxconn = maxconn
+        self._timeout = timeout
+        self._pool = None
+        self._slots = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._in_use = 0
+        self._in_use_lock = threading.Lock()
+        # Schema setup uses a throwaway connection so nothing is left open
+        # for forked workers to inherit
+        conn = psycopg2.connect(dsn)
+        try:
+            with conn, conn.cursor() as cur:
+                for statement in self.SCHEMA:
+                    cur.execute(statement)
+        finally:
+            conn.close()
+
+    def _get_pool(self):
+        """This process's connection pool, created on first use after any fork."""
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = self._pool_class(self._minconn, self._maxconn, self._dsn)
+                    # getconn() raises PoolError instead of waiting once maxconn are out
+                    self._slots = threading.BoundedSemaphore(self._maxconn)
+                    self._pool_pid = os.getpid()
+                    self._in_use = 0
+        return self._pool
+
+    @contextmanager
+    def _connection(self):
+        """Check out a pooled connection; commit on success, roll back on error."""
+        pool = self._get_pool()
+        slots = self._slots
+        if not slots.acquire(timeout=self._timeout):
+            raise TimeoutError(f'No database connection available after {self._timeout}s')
+        try:
+            conn = pool.getconn()
+        except Exception:
+            slots.release()
+            raise
+        with self._in_use_lock:
+            self._in_use += 1
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            with self._in_use_lock:
+                self._in_use -= 1
+            pool.putconn(conn, close=bool(conn.closed))
+            slots.release()
+
+    def _fetch(self, sql, params=()):
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(_pg(sql), params)
+            return cur.fetchall()
+
+    def create_order(self, order):
+        order_row, item_rows = order_rows(order)
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(self.INSERT_ORDER, order_row)
+            self._extras.execute_batch(cur, self.INSERT_ORDER_ITEM, item_rows)
+
+    def get_order(self, order_id):
+        columns = select_columns()
+        rows = self._fetch(f'SELECT {columns} FROM orders WHERE order_id = ?', (order_id,))
+        if not rows:
+            rows = self._fetch(f'SELECT {columns} FROM orders_archive WHERE order_id = ?', (order_id,))
+        return Order.from_row(rows[0]) if rows else None
+
+    def _list_orders(self, conditions=(), params=(), limit=None, after=None, fields=None, table='orders'):
+        fields = resolve_fields(fields)
+        params = list(params) + list(after or ())
+        if limit is not None:
+            params.append(limit)
+        sql = build_orders_query(conditions, paged=bool(after), limited=limit is not None, fields=fields,
+                                 table=table)
+        return [Order.from_row(r, fields) for r in self._fetch(sql, params)]
+
+    def _iter_orders(self, conditions=(), params=(), after=None, fields=None):
+        fields = resolve_fields(fields)
+        params = list(params) + list(after or ())
+        sql = build_orders_query(conditions, paged=bool(after), fields=fields)
+        with self._connection() as conn:
+            # Named cursor = server-side cursor, fetched CHUNK_SIZE rows at a time
+            with conn.cursor(name=f'orders_{uuid.uuid4().hex}') as cur:
+                cur.itersize = self.CHUNK_SIZE
+                cur.execute(_pg(sql), params)
+                for r in cur:
+                    yield Order.from_row(r, fields)
+
+    def get_orders_by_user(self, user_id, limit=None, after=None, fields=None):
+        streams = [self._list_orders(['user_id = ?'], [user_id], limit=limit, after=after, fields=fields,
+                                     table=table)
+                   for table in ('orders', 'orders_archive')]
+        return list(islice(merge_orders(streams), limit))
+
+    def get_all_orders(self, limit=None, after=None, fields=None):
+        return self._list_orders(limit=limit, after=after, fields=fields)
+
+    def get_orders_by_restaurant(self, restaurant_id, status=None, since=None, until=None, limit=None,
+                                 after=None, fields=None):
+        conditions, params = restaurant_conditions(restaurant_id, status, since, until, after)
+        return self._list_orders(conditions, params, limit=limit, after=after, fields=fields)
+
+    def iter_all_orders(self, after=None, fields=None):
+        return self._iter_orders(after=after, fields=fields)
+
+    def iter_orders_by_restaurant(self, restaurant_id, status=None, since=None, until=None, after=None,
+                                  fields=None):
+        conditions, params = restaurant_conditions(restaurant_id, status, since, until, after)
+        return self._iter_orders(conditions, params, after=after, fields=fields)
+
+    def get_orders_with_unknown_status(self, limit=None, after=None, fields=None):
+        conditions, params = unknown_status_conditions()
+        return self._list_orders(conditions, params, limit=limit, after=after, fields=fields)
+
+    def update_order_status(self, order_id, new_status, expected_status=None, force=False):
+        new_status, from_statuses = transition_sources(order_id, new_status, expected_status, force)
+        sql = 'UPDATE orders SET status = %s, updated_at = %s WHERE order_id = %s'
+        params = [new_status, datetime.now().isoformat(), order_id]
+        if from_statuses is not None:
+            sql += ' AND status = ANY(%s)'
+            params.append(from_statuses)
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(f'{sql} RETURNING {select_columns()}', params)
+            row = cur.fetchone()
+            if row is None:
+                cur.execute('SELECT status FROM orders WHERE order_id = %s', (order_id,))
+                current = cur.fetchone()
+        if row is not None:
+            return Order.from_row(row)
+        if current is None:
+            return None
+        raise StatusConflictError(order_id, current[0], new_status)
+
+    def get_top_items(self, restaurant_id, limit=10):
+        rows = self._fetch(
+            'SELECT item_id, max(item_name), sum(quantity) AS total_quantity, count(*) AS order_lines '
+            'FROM order_items WHERE restaurant_id = ? GROUP BY item_id ORDER BY total_quantity DESC LIMIT ?',
+            (restaurant_id, limit))
+        return [{'item_id': r[0], 'item_name': r[1], 'total_quantity': r[2], 'order_lines': r[3]} for r in rows]
+
+    def get_item_sales(self, item_id):
+        rows = self._fetch(
+            'SELECT restaurant_id, sum(quantity) AS total_quantity, count(*) AS order_lines '
+            'FROM order_items WHERE item_id = ? GROUP BY restaurant_id ORDER BY total_quantity DESC',
+            (item_id,))
+        return [{'restaurant_id': r[0], 'total_quantity': r[1], 'order_lines': r[2]} for r in rows]
+
+    def iter_orders_ndjson(self, include_archive=True):
+        tables = ('orders', 'orders_archive') if include_archive else ('orders',)
+        with self._connection() as conn:
+            def stream(table):
+                with conn.cursor(name=f'export_{uuid.uuid4().hex}') as cur:
+                    cur.itersize = self.CHUNK_SIZE
+                    cur.execute(f'SELECT {select_columns()} FROM {table} ORDER BY created_at, order_id')
+                    for r in cur:
+                        yield Order.from_row(r)
+
+            streams = [stream(table) for table in tables]
+            try:
+                merged = merge_orders(streams, newest_first=False)
+                while True:
+                    chunk = list(islice(merged, self.CHUNK_SIZE))
+                    if not chunk:
+                        break
+                    yield ''.join(order.to_json() + '\n' for order in chunk)
+            finally:
+                for s in streams:
+                    s.close()
+
+    def import_orders(self, lines, skip_existing=False):
+        suffix = ' ON CONFLICT DO NOTHING' if skip_existing else ''
+        spools, count = spool_import(lines)
+        if not spools:
+            return count
+        with spools[0] as fp, self._connection() as conn, conn.cursor() as cur:
+            def flush(batch):
+                rows = [order_rows(order) for _, order in batch]
+                cur.execute('SAVEPOINT import_batch')
+                try:
+                    self._extras.execute_batch(cur, self.INSERT_ORDER + suffix, [r[0] for r in rows])
+                except self._unique_violation:
+                    cur.execute('ROLLBACK TO SAVEPOINT import_batch')
+                    for (line_no, order), (order_row, _) in zip(batch, rows):
+                        try:
+                            cur.execute(self.INSERT_ORDER, order_row)
+                        except self._unique_violation as e:
+                            raise DuplicateOrderError(order['order_id'], line_no) from e
+                    raise
+                self._extras.execute_batch(cur, self.INSERT_ORDER_ITEM + suffix, [i for r in rows for i in r[1]])
+                cur.execute('RELEASE SAVEPOINT import_batch')
+
+            batch = []
+            for entry in iter_spooled(fp):
+                batch.append(entry)
+                if len(batch) >= self.CHUNK_SIZE:
+                    flush(batch)
+                    batch = []
+            if batch:
+                flush(batch)
+        return count
+
+    def archive_orders(self, older_than_days=None, dry_run=False):
+        if older_than_days is None:
+            older_than_days = ARCHIVE_AFTER_DAYS
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+        where = 'status = ANY(%s) AND created_at < %s'
+        where_params = [sorted(TERMINAL_STATUSES), cutoff]
+        if dry_run:
+            with self._connection() as conn, conn.cursor() as cur:
+                cur.execute(f'SELECT count(*) FROM orders WHERE {where}', where_params)
+                return cur.fetchone()[0]
+
+        columns = select_columns()
+        moved = 0
+        while True:
+            # One short transaction per batch; Postgres makes each batch atomic
+            with self._connection() as conn, conn.cursor() as cur:
+                cur.execute(f'SELECT order_id FROM orders WHERE {where} LIMIT %s FOR UPDATE SKIP LOCKED',
+                            [*where_params, ARCHIVE_BATCH_SIZE])
+                ids = [r[0] for r in cur.fetchall()]
+                if not ids:
+                    break
+                cur.execute(f'INSERT INTO order_items_archive ({ORDER_ITEM_COLUMNS}) '
+                            f'SELECT {ORDER_ITEM_COLUMNS} FROM order_items WHERE order_id = ANY(%s) '
+                            f'ON CONFLICT DO NOTHING', (ids,))
+                cur.execute(f'INSERT INTO orders_archive ({columns}, archived_at) '
+                            f'SELECT {columns}, %s FROM orders WHERE order_id = ANY(%s) ON CONFLICT DO NOTHING',
+                            (datetime.now().isoformat(), ids))
+                cur.execute('DELETE FROM orders WHERE order_id = ANY(%s)', (ids,))
+            moved += len(ids)
+        return moved
+
+    def get_metrics(self):
+        with self._in_use_lock:
+            in_use = self._in_use
+        return {'backend': 'postgres', 'pool': {'max_size': self._maxconn, 'in_use': in_use}}
+
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_repository():
+    """The process-wide OrderRepository selected by ORDERS_BACKEND."""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                started = time.monotonic()
+                if ORDERS_BACKEND == 'sqlite':
+                    _repository = SQLiteOrderRepository()
+                elif ORDERS_BACKEND in ('postgres', 'postgresql'):
+                    _repository = PostgresOrderRepository()
+                else:
+                    raise RuntimeError(f'Unknown ORDERS_BACKEND: {ORDERS_BACKEND!r} (expected sqlite or postgres)')
+                print(f'🗄️ Orders backend: {ORDERS_BACKEND} (ready in {time.monotonic() - started:.2f}s)')
+    return _repository
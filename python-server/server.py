@@ -5,36 +5,141 @@ Handles Orders and Payments
 Communicates with Frontend via Gateway & Node Server
 """
 
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, current_app, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.local import LocalProxy
 import uuid
+import json
+from itertools import islice
 from datetime import datetime
-import requests
 import os
-from db import (
-    create_order as db_create_order,
-    get_orders_by_user as db_get_orders_by_user,
-    get_order as db_get_order,
-    update_order_status as db_update_order_status,
-    get_all_orders as db_get_all_orders,
+import time
+from orders import (
+    encode_cursor,
+    decode_cursor,
+    parse_quantity,
+    resolve_fields,
+    DuplicateOrderError,
+    InvalidStatusError,
+    StatusConflictError,
 )
+from repository import get_repository
+from node_client import node, fetch_order_context, invalidate_restaurant, cache_stats
 
-app = Flask(__name__)
-CORS(app)
+# Routes live on a blueprint; create_app() builds the Flask app. Importing
+# this module opens no database: run with  gunicorn --preload 'server:create_app()'
+bp = Blueprint('orders', __name__)
 
 PORT = int(os.environ.get('PORT', 5001))
-NODE_SERVER_URL = os.environ.get('NODE_SERVER_URL', 'http://localhost:5002')  # Direct Node Server communication
 
-# Orders are persisted in SQLite via db.py
+# Orders are persisted through an OrderRepository (SQLite via db.py by default,
+# see ORDERS_BACKEND in repository.py), resolved on first use
+orders_repo = LocalProxy(get_repository)
+
+# Order listings are keyset-paginated: ?limit=N&after=<next_cursor>
+DEFAULT_PAGE_SIZE = int(os.environ.get('ORDERS_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('ORDERS_MAX_PAGE_SIZE', 200))
+
+# ?stream=ndjson|json returns the full listing as a streamed body instead
+STREAM_FORMATS = ('ndjson', 'json')
+STREAM_BATCH_SIZE = 100  # orders per written chunk
+
+# ==================== HELPERS ====================
+
+def get_fields_arg():
+    """?fields=summary or ?fields=a,b,c selects which order fields to return."""
+    fields = request.args.get('fields')
+    return resolve_fields(fields) if fields else None
+
+def get_limit_arg(default=DEFAULT_PAGE_SIZE):
+    """Parse ?limit=, capped at MAX_PAGE_SIZE. Raises ValueError unless it is a positive integer."""
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return min(limit, MAX_PAGE_SIZE)
+
+def get_page_args():
+    """Parse ?limit= and ?after= into (limit, keyset). Raises ValueError on bad input."""
+    return get_limit_arg(), decode_cursor(request.args.get('after'))
+
+def get_stream_arg():
+    """?stream=ndjson or ?stream=json, else None. Raises ValueError on other values."""
+    fmt = request.args.get('stream')
+    if fmt and fmt not in STREAM_FORMATS:
+        raise ValueError(f'stream must be one of: {", ".join(STREAM_FORMATS)}')
+    return fmt
+
+def stream_orders_response(orders, fmt):
+    """
+    Stream an iterable of Order records without building the body in memory.
+    'ndjson': one order per line. 'json': {"orders": [...]} written incrementally.
+    """
+    def generate():
+        if fmt == 'json':
+            yield '{"orders": ['
+        separator = '\n' if fmt == 'ndjson' else ', '
+        first = True
+        iterator = iter(orders)
+        while True:
+            batch = list(islice(iterator, STREAM_BATCH_SIZE))
+            if not batch:
+                break
+            chunk = separator.join(o.to_json() for o in batch)
+            if fmt == 'ndjson':
+                yield chunk + '\n'
+            else:
+                yield chunk if first else separator + chunk
+            first = False
+        if fmt == 'json':
+            yield '], "next_cursor": null}'
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    return Response(generate(), mimetype=mimetype)
+
+def status_conflict_response(e):
+    """409 for a rejected status transition, reporting the order's current status."""
+    return jsonify({'error': str(e), 'current_status': e.current_status}), 409
+
+def json_response(body, status=200):
+    """Response from an already-serialized JSON string."""
+    return current_app.response_class(body, status=status, mimetype='application/json')
+
+def order_response(order, status=200):
+    """JSON response for a db Order record."""
+    return json_response(order.to_json(), status)
+
+def page_response(orders, limit):
+    """JSON page of orders; `orders` was fetched with limit + 1 to detect a next page."""
+    next_cursor = encode_cursor(orders[limit - 1]) if len(orders) > limit else None
+    body = ', '.join(o.to_json() for o in orders[:limit])
+    return json_response(f'{{"orders": [{body}], "next_cursor": {json.dumps(next_cursor)}}}')
 
 # ==================== ROUTES ====================
 
-@app.route('/health', methods=['GET'])
+@bp.before_app_request
+def start_background_jobs():
+    """Housekeeping threads (e.g. DB_MAINTENANCE_WINDOW) start in each worker after fork"""
+    orders_repo.start_background_jobs()
+
+@bp.route('/health', methods=['GET'])
 def health():
     """Health Check"""
     return jsonify({'status': 'Python Server Healthy', 'timestamp': datetime.now().isoformat()})
 
-@app.route('/orders', methods=['POST'])
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Storage and performance counters"""
+    return jsonify({
+        'db': orders_repo.get_metrics(),
+        'node_cache': cache_stats(),
+        'node_breakers': node.breaker_stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@bp.route('/orders', methods=['POST'])
 def create_order():
     """
     Create Order
@@ -52,40 +157,25 @@ def create_order():
         
         if not data:
             return jsonify({'error': 'No data provided'}), 400
+        for item in data.get('items', []):
+            if not isinstance(item, dict):
+                return jsonify({'error': 'Each item must be an object'}), 400
+            try:
+                item['quantity'] = parse_quantity(item.get('quantity'))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
         # ========== INTER-SERVICE COMMUNICATION ==========
-        # Fetch restaurant details from Node Server
+        # Restaurant details and menu item images from Node Server (cached)
         restaurant_id = data.get('restaurant_id')
-        try:
-            restaurant_response = requests.get(
-                f'{NODE_SERVER_URL}/restaurants/{restaurant_id}',
-                timeout=5
-            )
-            if restaurant_response.status_code == 200:
-                restaurant = restaurant_response.json()
-                print(f'📡 Fetched restaurant from Node Server: {restaurant.get("name")}')
-            else:
-                print(f'⚠️ Could not fetch restaurant from Node Server')
-                restaurant = None
-        except Exception as e:
-            print(f'❌ Node Server communication error: {e}')
-            restaurant = None
-        
-        # Fetch menu items with images from Node Server
-        menu_items_map = {}
-        try:
-            menu_response = requests.get(
-                f'{NODE_SERVER_URL}/restaurants/{restaurant_id}/menu',
-                timeout=5
-            )
-            if menu_response.status_code == 200:
-                menu = menu_response.json().get('menu', [])
-                # Build map of item_id -> image_url
-                for menu_item in menu:
-                    menu_items_map[menu_item.get('item_id')] = menu_item.get('image_url')
-                print(f'📡 Fetched menu with {len(menu)} items from Node Server')
-        except Exception as e:
-            print(f'⚠️ Could not fetch menu images: {e}')
+        item_ids = [item.get('item_id') for item in data.get('items', [])]
+        restaurant, menu_items_map = fetch_order_context(restaurant_id, item_ids)
+        if restaurant:
+            print(f'📡 Restaurant from Node Server: {restaurant.get("name")}')
+        else:
+            print('⚠️ Could not fetch restaurant from Node Server')
+        # item_id -> image_url for the ordered items
+        menu_items_map = menu_items_map or {}
         
         items_with_images = []
         for item in data.get('items', []):
@@ -94,7 +184,7 @@ def create_order():
             quantity = item.get('quantity', 1)
             
             # Use fetched image or fallback to Unsplash
-            image_url = menu_items_map.get(item_id) or f"https://source.unsplash.com/400x250/?{item_name.replace(' ', '%20')}%20food"
+            image_url = menu_items_map.get(str(item_id)) or f"https://source.unsplash.com/400x250/?{item_name.replace(' ', '%20')}%20food"
             
             items_with_images.append({
                 'item_id': item_id,
@@ -117,7 +207,7 @@ def create_order():
             'created_at': datetime.now().isoformat()
         }
         
-        db_create_order(order)
+        orders_repo.create_order(order)
         print(f'✅ Order created: {order_id}')
         return jsonify(order), 201
     except Exception as e:
@@ -126,65 +216,145 @@ def create_order():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/orders', methods=['GET'])
+@bp.route('/orders', methods=['GET'])
 def get_user_orders():
-    """Get Orders by User"""
+    """Get Orders by User, archived orders included (paginated, optional ?fields= projection)"""
     try:
         user_id = request.args.get('user_id')
         if not user_id:
-            return jsonify({'orders': []}), 200
+            return jsonify({'orders': [], 'next_cursor': None}), 200
         
-        return jsonify({'orders': db_get_orders_by_user(user_id)}), 200
+        limit, after = get_page_args()
+        return page_response(orders_repo.get_orders_by_user(user_id, limit=limit + 1, after=after, fields=get_fields_arg()), limit), 200
+    except ValueError as e:
+        return jsonify({'error': str(e), 'orders': []}), 400
     except Exception as e:
         print(f'❌ Error getting orders: {e}')
         return jsonify({'error': str(e), 'orders': []}), 500
 
-@app.route('/orders/<order_id>', methods=['GET'])
+@bp.route('/orders/<order_id>', methods=['GET'])
 def get_order(order_id):
     """Get Order Details"""
     try:
-        order = db_get_order(order_id)
+        order = orders_repo.get_order(order_id)
         if not order:
             return jsonify({'error': 'Order not found'}), 404
-        return jsonify(order), 200
+        return order_response(order)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/orders/<order_id>', methods=['PUT'])
+@bp.route('/orders/<order_id>', methods=['PUT'])
 def update_order(order_id):
-    """Update Order Status"""
+    """Update Order Status (optional expected_status for compare-and-set)"""
     try:
         data = request.json
         new_status = data.get('status')
-        order = db_update_order_status(order_id, new_status)
+        order = orders_repo.update_order_status(order_id, new_status, data.get('expected_status'))
         if not order:
             return jsonify({'error': 'Order not found'}), 404
         print(f'✅ Order {order_id} updated to {order["status"]}')
-        return jsonify(order), 200
+        return order_response(order)
+    except InvalidStatusError as e:
+        return jsonify({'error': str(e)}), 400
+    except StatusConflictError as e:
+        return status_conflict_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # ==================== ADMIN ROUTES ====================
 
-@app.route('/admin/orders', methods=['GET'])
+@bp.route('/admin/orders', methods=['GET'])
 def admin_get_all_orders():
-    """Get All Orders (Admin)"""
+    """Get All Orders (Admin, paginated or ?stream=ndjson|json, optional ?fields= projection)"""
+    try:
+        limit, after = get_page_args()
+        stream = get_stream_arg()
+        if stream:
+            return stream_orders_response(orders_repo.iter_all_orders(after=after, fields=get_fields_arg()), stream)
+        return page_response(orders_repo.get_all_orders(limit=limit + 1, after=after, fields=get_fields_arg()), limit), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/admin/orders/export', methods=['GET'])
+def admin_export_orders():
+    """Export All Orders, archived ones included, as streamed NDJSON (Admin). ?include_archive=0 leaves them out."""
+    include_archive = request.args.get('include_archive', '1').lower() not in ('0', 'false', 'no')
+    return Response(stream_with_context(orders_repo.iter_orders_ndjson(include_archive=include_archive)),
+                    mimetype='application/x-ndjson')
+
+@bp.route('/admin/orders/import', methods=['POST'])
+def admin_import_orders():
+    """
+    Bulk Import Orders (Admin)
+    Body: NDJSON, one order per line. ?skip_existing=1 ignores known order_ids.
+    All-or-nothing: any bad line (400) or already-known order_id (409) rolls
+    back the whole import.
+    """
+    try:
+        skip_existing = request.args.get('skip_existing', '').lower() in ('1', 'true', 'yes')
+        count = orders_repo.import_orders(request.stream, skip_existing=skip_existing)
+        print(f'✅ Imported {count} orders')
+        return jsonify({'imported': count}), 200
+    except DuplicateOrderError as e:
+        return jsonify({'error': str(e), 'order_id': e.order_id, 'line': e.line_no}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f'❌ Error importing orders: {e}')
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/admin/orders/archive', methods=['POST'])
+def admin_archive_orders():
+    """
+    Move Old Finished Orders to the Archive DB (Admin)
+    Optional body: {"older_than_days": 90, "dry_run": false}
+    """
     try:
-        return jsonify({'orders': db_get_all_orders()}), 200
+        data = request.get_json(silent=True) or {}
+        kwargs = {'dry_run': bool(data.get('dry_run'))}
+        if data.get('older_than_days') is not None:
+            kwargs['older_than_days'] = int(data['older_than_days'])
+        count = orders_repo.archive_orders(**kwargs)
+        return jsonify({'archived': 0 if kwargs['dry_run'] else count, 'matched': count}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
+        print(f'❌ Error archiving orders: {e}')
         return jsonify({'error': str(e)}), 500
 
-@app.route('/admin/orders/<order_id>/status', methods=['PUT'])
+@bp.route('/admin/orders/unknown-status', methods=['GET'])
+def admin_get_unknown_status_orders():
+    """Orders whose status is outside the lifecycle (Admin, paginated); repair them with a forced status update"""
+    try:
+        limit, after = get_page_args()
+        orders = orders_repo.get_orders_with_unknown_status(limit=limit + 1, after=after, fields=get_fields_arg())
+        return page_response(orders, limit), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/admin/orders/<order_id>/status', methods=['PUT'])
 def admin_update_order_status(order_id):
-    """Update Order Status (Admin Only) and notify Node Server"""
+    """
+    Update Order Status (Admin Only) and notify Node Server
+    Expected: {"status": "...", "expected_status": "..." (optional), "force": true (optional)}
+    "force" skips the lifecycle rules to repair orders stuck in an unknown status
+    """
     try:
         data = request.json
-        order = db_get_order(order_id)
+        new_status = data.get('status')
+        if new_status:
+            order = orders_repo.update_order_status(order_id, new_status, data.get('expected_status'),
+                                                    force=bool(data.get('force')))
+        else:
+            order = orders_repo.get_order(order_id)
         if not order:
             return jsonify({'error': 'Order not found'}), 404
-        new_status = data.get('status')
         if new_status:
-            order = db_update_order_status(order_id, new_status)
+            new_status = order['status']
             print(f'✅ Admin updated order {order_id} to {new_status}')
             # Notify Node Server about status update
             try:
@@ -194,56 +364,108 @@ def admin_update_order_status(order_id):
                     'updated_at': order['updated_at'],
                     'message': f'Order {order_id} status changed to {new_status}'
                 }
-                node_response = requests.post(
-                    f'{NODE_SERVER_URL}/notifications/order-status-update',
-                    json=notification,
-                    timeout=5
-                )
+                node_response = node.post('/notifications/order-status-update', 'notifications', json=notification)
                 if node_response.status_code == 200:
                     print('📡 Notified Node Server about status update')
                 else:
                     print('⚠️ Node Server notification failed')
             except Exception as e:
                 print(f'⚠️ Could not notify Node Server: {e}')
-        return jsonify(order), 200
+        return order_response(order)
+    except InvalidStatusError as e:
+        return jsonify({'error': str(e)}), 400
+    except StatusConflictError as e:
+        return status_conflict_response(e)
     except Exception as e:
         print(f'❌ Error updating order: {e}')
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/admin/items/<item_id>/sales', methods=['GET'])
+def admin_item_sales(item_id):
+    """Quantity Ordered of an Item per Restaurant (Admin)"""
+    try:
+        return jsonify({'item_id': item_id, 'restaurants': orders_repo.get_item_sales(item_id)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ==================== INTER-SERVICE ROUTES ====================
+
+@bp.route('/interservice/cache/invalidate', methods=['POST'])
+def invalidate_node_cache():
+    """
+    Drop cached restaurant/menu data (called by Node Server on menu changes)
+    Expected: {"restaurant_id": "..."} or {"item_id": "..."}; empty clears everything
+    """
+    data = request.get_json(silent=True) or {}
+    invalidate_restaurant(data.get('restaurant_id'), data.get('item_id'))
+    print(f'🧹 Invalidated cached restaurant data: {data or "all"}')
+    return jsonify({'message': 'Cache invalidated'}), 200
+
 # ==================== RESTAURANT MANAGER ROUTES ====================
 
-@app.route('/restaurant/<restaurant_id>/orders', methods=['GET'])
+@bp.route('/restaurant/<restaurant_id>/orders', methods=['GET'])
 def restaurant_get_orders(restaurant_id):
-    """Get Orders for Restaurant"""
+    """
+    Get Orders for Restaurant (paginated, or streamed with ?stream=ndjson|json)
+    Optional query params: status, since, until (ISO timestamps), fields
+    """
+    try:
+        limit, after = get_page_args()
+        stream = get_stream_arg()
+        if stream:
+            return stream_orders_response(orders_repo.iter_orders_by_restaurant(
+                restaurant_id,
+                status=request.args.get('status'),
+                since=request.args.get('since'),
+                until=request.args.get('until'),
+                after=after,
+                fields=get_fields_arg()
+            ), stream)
+        restaurant_orders = orders_repo.get_orders_by_restaurant(
+            restaurant_id,
+            status=request.args.get('status'),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            limit=limit + 1,
+            after=after,
+            fields=get_fields_arg()
+        )
+        return page_response(restaurant_orders, limit), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/restaurant/<restaurant_id>/top-items', methods=['GET'])
+def restaurant_top_items(restaurant_id):
+    """Best-selling Items for Restaurant (optional ?limit=, default 10)"""
     try:
-        orders = db_get_all_orders()
-        # Filter orders for this restaurant
-        restaurant_orders = [o for o in orders if o.get('restaurant_id') == restaurant_id]
-        return jsonify({'orders': restaurant_orders}), 200
+        limit = get_limit_arg(default=10)
+        return jsonify({'items': orders_repo.get_top_items(restaurant_id, limit)}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/restaurant/orders/<order_id>/status', methods=['PUT'])
+@bp.route('/restaurant/orders/<order_id>/status', methods=['PUT'])
 def restaurant_update_order_status(order_id):
     """Update Order Status (Restaurant Manager)"""
     try:
         data = request.json
-        order = db_get_order(order_id)
-        if not order:
-            return jsonify({'error': 'Order not found'}), 404
-        
         new_status = data.get('status')
         action = data.get('action')  # 'accept', 'reject', or 'update'
         
         # Map actions to statuses
         status_map = {
-            'accept': 'PREPARING',
-            'reject': 'REJECTED',
+            'accept': 'preparing',
+            'reject': 'rejected',
             'update': new_status
         }
         
-        final_status = status_map.get(action, new_status)
-        order = db_update_order_status(order_id, final_status)
+        order = orders_repo.update_order_status(order_id, status_map.get(action, new_status), data.get('expected_status'))
+        if not order:
+            return jsonify({'error': 'Order not found'}), 404
+        final_status = order['status']
         
         print(f'✅ Restaurant updated order {order_id} to {final_status}')
         
@@ -254,28 +476,45 @@ def restaurant_update_order_status(order_id):
                 'status': final_status,
                 'message': f'Order status: {final_status}'
             }
-            requests.post(
-                f'{NODE_SERVER_URL}/notifications/order-status-update',
-                json=notification,
-                timeout=5
-            )
+            node.post('/notifications/order-status-update', 'notifications', json=notification)
         except Exception as e:
             print(f'⚠️ Could not notify Node Server: {e}')
         
-        return jsonify(order), 200
+        return order_response(order)
+    except InvalidStatusError as e:
+        return jsonify({'error': str(e)}), 400
+    except StatusConflictError as e:
+        return status_conflict_response(e)
     except Exception as e:
         print(f'❌ Error updating order: {e}')
         return jsonify({'error': str(e)}), 500
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def server_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
+# ==================== APP FACTORY ====================
+
+def create_app():
+    """
+    Build the Flask app and open the orders store (migrations, index checks).
+    Under gunicorn --preload this runs once in the master; database
+    connections are opened lazily in each worker after fork.
+    """
+    started = time.monotonic()
+    app = Flask(__name__)
+    CORS(app)
+    app.register_blueprint(bp)
+    get_repository()
+    print(f'⏱️ App ready in {1000 * (time.monotonic() - started):.0f} ms')
+    return app
+
 if __name__ == '__main__':
+    app = create_app()
     print(f"""
 ╔════════════════════════════════════════╗
 ║    🚀 Python Backend Server Started    ║
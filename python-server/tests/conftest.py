@@ -0,0 +1,5 @@
+# The server modules live at the top of python-server/, not in a package
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
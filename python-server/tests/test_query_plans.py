@@ -0,0 +1,58 @@
+# EXPLAIN QUERY PLAN assertions for the hot queries in db.py: each must be
+# answered from an index, without a full scan or a temp sort.
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+from orders import ORDER_STATUSES
+
+
+@pytest.fixture(scope='module')
+def pool(tmp_path_factory):
+    pool = db.ConnectionPool(str(tmp_path_factory.mktemp('plans') / 'orders.db'), size=1)
+    db.init_schema(pool)
+    yield pool
+    pool.close()
+
+
+def _seed(conn, count=2000):
+    """Skewed sample data, so ANALYZE gives the planner realistic statistics."""
+    rng = random.Random(0)
+    now = datetime(2024, 1, 1)
+    for i in range(count):
+        items = [{'item_id': f'i{rng.randrange(50)}', 'item_name': 'x', 'quantity': rng.randrange(1, 4)}]
+        order = {'order_id': f'o{i}', 'user_id': f'u{rng.randrange(200)}', 'restaurant_id': f'r{rng.randrange(5)}',
+                 'restaurant_name': 'R', 'items': items, 'total': 10.0, 'status': rng.choice(ORDER_STATUSES),
+                 'created_at': (now + timedelta(minutes=i)).isoformat()}
+        order_row, item_rows = db.order_rows(order)
+        conn.execute(db.SQL_INSERT_ORDER, order_row)
+        conn.executemany(db.SQL_INSERT_ORDER_ITEM, item_rows)
+    conn.commit()
+
+
+@pytest.mark.parametrize('name, sql, params', db.QUERY_PLAN_CHECKS, ids=[c[0] for c in db.QUERY_PLAN_CHECKS])
+def test_hot_query_uses_index(pool, name, sql, params):
+    with pool.connection() as conn:
+        plan = db.explain_query_plan(conn, sql, params)
+    assert db.uses_index(plan, grouped='GROUP BY' in sql), f'{name}: {json.dumps(plan)}'
+
+
+@pytest.mark.parametrize('name, sql, params', db.QUERY_PLAN_CHECKS, ids=[c[0] for c in db.QUERY_PLAN_CHECKS])
+def test_hot_query_uses_index_after_analyze(tmp_path, name, sql, params):
+    pool = db.ConnectionPool(str(tmp_path / 'orders.db'), size=1)
+    try:
+        db.init_schema(pool)
+        with pool.connection() as conn:
+            _seed(conn)
+            conn.execute('ANALYZE')
+            plan = db.explain_query_plan(conn, sql, params)
+    finally:
+        pool.close()
+    assert db.uses_index(plan, grouped='GROUP BY' in sql), f'{name}: {json.dumps(plan)}'
+
+
+def test_expected_indexes_exist(pool):
+    db.check_indexes(pool)
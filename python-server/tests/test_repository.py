@@ -0,0 +1,146 @@
+# The same behaviour checks against every OrderRepository backend. SQLite
+# runs on a temporary file; Postgres runs only when ORDERS_DATABASE_URL points
+# at a scratch database (e.g. a local postgres or pgserver instance) - its
+# tables are dropped first.
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+from orders import DuplicateOrderError, StatusConflictError, InvalidStatusError
+from repository import SQLiteOrderRepository, PostgresOrderRepository
+
+PG_TABLES = 'order_items, order_items_archive, orders, orders_archive'
+
+
+@pytest.fixture
+def sqlite_repo(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, '_shards', [])
+    monkeypatch.setattr(db, '_archive_pool', None)
+    monkeypatch.setattr(db, 'ARCHIVE_DB_PATH', str(tmp_path / 'orders_archive.db'))
+    shards = db.init_db(str(tmp_path / 'orders.db'), shard_count=1)
+    yield SQLiteOrderRepository()
+    for shard in shards:
+        shard.write_pool.close()
+        shard.read_pool.close()
+
+
+@pytest.fixture
+def postgres_repo():
+    dsn = os.environ.get('ORDERS_DATABASE_URL')
+    if not dsn:
+        pytest.skip('ORDERS_DATABASE_URL is not set')
+    psycopg2 = pytest.importorskip('psycopg2')
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    conn.cursor().execute(f'DROP TABLE IF EXISTS {PG_TABLES} CASCADE')
+    conn.close()
+    repo = PostgresOrderRepository(dsn, minconn=1, maxconn=2, timeout=0.2)
+    yield repo
+    repo._get_pool().closeall()
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def repo(request):
+    return request.getfixturevalue(f'{request.param}_repo')
+
+
+def _order(i, status='pending'):
+    return {'order_id': f'o{i:03d}', 'user_id': f'u{i % 3}', 'restaurant_id': f'r{i % 2}', 'restaurant_name': 'R',
+            'items': [{'item_id': f'i{i % 4}', 'item_name': f'n{i % 4}', 'quantity': 1 + i % 2}],
+            'total': 10.0, 'status': status,
+            'created_at': (datetime(2024, 1, 1) + timedelta(minutes=i)).isoformat()}
+
+
+def test_create_and_get(repo):
+    repo.create_order(_order(1))
+    order = repo.get_order('o001')
+    assert order['user_id'] == 'u1' and order['items'][0]['item_id'] == 'i1'
+    assert repo.get_order('missing') is None
+
+
+def test_keyset_pagination(repo):
+    for i in range(12):
+        repo.create_order(_order(i))
+    full = repo.get_orders_by_user('u0')
+    first = repo.get_orders_by_user('u0', limit=2)
+    rest = repo.get_orders_by_user('u0', limit=100, after=(first[-1]['created_at'], first[-1]['order_id']))
+    assert [o['order_id'] for o in first + rest] == [o['order_id'] for o in full]
+    assert len(full) == 4
+    assert len(list(repo.iter_all_orders())) == 12
+
+
+def test_status_transitions(repo):
+    repo.create_order(_order(1))
+    assert repo.update_order_status('o001', 'accepted')['status'] == 'accepted'
+    with pytest.raises(StatusConflictError):
+        repo.update_order_status('o001', 'pending')
+    with pytest.raises(StatusConflictError):
+        repo.update_order_status('o001', 'preparing', expected_status='pending')
+    with pytest.raises(InvalidStatusError):
+        repo.update_order_status('o001', 'bogus')
+    assert repo.update_order_status('missing', 'accepted') is None
+
+
+def test_concurrent_compare_and_set_has_one_winner(repo):
+    repo.create_order(_order(1))
+    results = []
+
+    def accept():
+        try:
+            results.append(repo.update_order_status('o001', 'accepted', expected_status='pending')['status'])
+        except StatusConflictError:
+            results.append('conflict')
+
+    threads = [threading.Thread(target=accept) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results) == ['accepted'] + ['conflict'] * 3
+
+
+def test_import_rolls_back_on_duplicate(repo):
+    repo.create_order(_order(5))
+    lines = [json.dumps(_order(i)) for i in range(10)]
+    with pytest.raises(DuplicateOrderError) as e:
+        repo.import_orders(lines)
+    assert e.value.order_id == 'o005' and e.value.line_no == 6
+    assert len(list(repo.iter_all_orders())) == 1
+    assert repo.import_orders(lines, skip_existing=True) == 10
+    assert len(list(repo.iter_all_orders())) == 10
+
+
+def test_export_round_trip(repo):
+    for i in range(5):
+        repo.create_order(_order(i))
+    exported = [json.loads(line) for chunk in repo.iter_orders_ndjson() for line in chunk.splitlines()]
+    assert sorted(o['order_id'] for o in exported) == [f'o{i:03d}' for i in range(5)]
+
+
+def test_postgres_pool_waits_then_times_out(postgres_repo):
+    # maxconn=2: a third caller waits for a free connection instead of
+    # failing straight away, and gives up after the timeout.
+    with postgres_repo._connection(), postgres_repo._connection():
+        with pytest.raises(TimeoutError):
+            with postgres_repo._connection():
+                pass
+    borrowed, hold = threading.Barrier(3), threading.Event()
+
+    def borrow():
+        with postgres_repo._connection():
+            borrowed.wait()
+            hold.wait()
+
+    holders = [threading.Thread(target=borrow) for _ in range(2)]
+    for t in holders:
+        t.start()
+    borrowed.wait()
+    threading.Timer(0.05, hold.set).start()
+    with postgres_repo._connection() as conn:
+        assert not conn.closed
+    for t in holders:
+        t.join()